@@ -1,6 +1,8 @@
 
 # 建立 binary_operations.py → 二進位處理模組
 
+from bit_buffer import bytes_to_bits, bits_to_bytes
+
 def int_to_binary(number, bit_length=8):
   """
   功能:
@@ -88,15 +90,11 @@ def text_to_utf8(text):
     - ASCII 字元: 1 byte = 8 bits
     - 中文字元: 3 bytes = 24 bits
   """
-  bits = []
-
   # 將字串編碼成 UTF-8
   text_bytes = text.encode('utf-8')
 
-  # 將每個 byte 轉換成 8 bits
-  for byte in text_bytes:
-    binary = int_to_binary(byte, 8)
-    bits.extend(binary)
+  # 將每個 byte 轉換成 8 bits（一次展開全部 bytes）
+  bits = bytes_to_bits(text_bytes).tolist()
 
   return bits
 
@@ -111,23 +109,17 @@ def utf8_to_text(bits):
   返回:
     text: 解碼後的文字字串
   """
-  byte_list = []
-
-  # 每 8 個 bit 組成一個 byte
-  for i in range(0, len(bits), 8):
-    byte = bits[i:i+8]
-    if len(byte) == 8:
-      byte_value = int(''.join(map(str, byte)), 2)
-      byte_list.append(byte_value)
+  # 每 8 個 bit 組成一個 byte（不足 8 bits 的尾端捨棄）
+  text_bytes = bits_to_bytes(bits)
 
   try:
     # 用 UTF-8 解碼
-    text = bytes(byte_list).decode('utf-8', errors='ignore')
+    text = text_bytes.decode('utf-8', errors='ignore')
 
     return text
 
   except:
     # 解碼失敗時，用替代字元處理
-    text = bytes(byte_list).decode('utf-8', errors='replace')
+    text = text_bytes.decode('utf-8', errors='replace')
 
     return text
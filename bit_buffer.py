@@ -0,0 +1,288 @@
+# bit_buffer.py → 位元緩衝區模組
+# 以打包的 uint8 陣列存放位元（每 byte 8 bits），取代 Python int 列表
+
+import io
+
+import numpy as np
+
+class BitBuffer:
+    """
+    功能:
+        緊密存放的位元序列，位元順序為 MSB first（與 np.packbits 預設相同）
+
+    屬性:
+        data: 打包後的 uint8 陣列，最後一個 byte 不足 8 bits 的部分固定補 0
+        length: 位元數量
+
+    用法:
+        BitBuffer.from_bits([0, 1, 0, 0, 0, 0, 0, 1])   # 由 0/1 列表建立
+        BitBuffer.from_bytes(b'A')                        # 由 bytes 建立
+        buf[3], buf[8:16], buf + other, len(buf)          # 取值、切片、串接、長度
+        buf.tolist(), buf.to_bytes(), buf.unpack()        # 轉回列表、bytes、0/1 陣列
+
+    相容性:
+        可以直接迭代，也可以傳給 np.asarray（得到 0/1 的 uint8 陣列），
+        所以原本接受位元列表的函式不需修改就能使用
+    """
+
+    __slots__ = ('data', 'length')
+
+    def __init__(self, data=None, length=None):
+        if data is None:
+            data = np.zeros(0, dtype=np.uint8)
+        elif isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data, dtype=np.uint8).reshape(-1)
+        else:
+            data = np.frombuffer(bytes(data), dtype=np.uint8)
+
+        max_length = len(data) * 8
+        if length is None:
+            length = max_length
+        if length < 0 or length > max_length:
+            raise ValueError(f"位元長度 {length} 超出資料範圍（最多 {max_length} bits）")
+
+        # 只保留需要的 bytes，並把多出來的補位清成 0
+        num_bytes = -(-length // 8)
+        data = data[:num_bytes]
+        if length % 8:
+            data = data.copy()
+            data[-1] &= (0xFF << (8 - length % 8)) & 0xFF
+
+        self.data = data
+        self.length = length
+
+    # ==================== 建立 ====================
+    @classmethod
+    def from_bits(cls, bits):
+        """
+        功能:
+            由 0/1 位元（列表、陣列或 BitBuffer）建立 BitBuffer
+        """
+        if isinstance(bits, BitBuffer):
+            return bits
+        bits = np.asarray(bits, dtype=np.uint8).reshape(-1)
+        return cls(np.packbits(bits), len(bits))
+
+    @classmethod
+    def from_bytes(cls, data, length=None):
+        """
+        功能:
+            由 bytes 建立 BitBuffer，length 省略時使用全部 bits
+        """
+        return cls(data, length)
+
+    @classmethod
+    def concat(cls, buffers):
+        """
+        功能:
+            依序串接多個位元序列（BitBuffer、列表或陣列）
+        """
+        buffers = [cls.from_bits(b) for b in buffers]
+        if all(b.length % 8 == 0 for b in buffers[:-1]):
+            # 前面都是整 byte，直接串接打包資料
+            data = np.concatenate([b.data for b in buffers]) if buffers else None
+            return cls(data, sum(b.length for b in buffers))
+
+        # 有不足 1 byte 的片段時，把後面的打包資料整體位移後接上（不展開成逐 bit 陣列）
+        result = buffers[0]
+        for buffer in buffers[1:]:
+            result = result._append(buffer)
+        return result
+
+    def _append(self, other):
+        """
+        功能:
+            串接兩段位元：other 的打包資料右移 (self.length % 8) bits 後接在 self 後面
+        """
+        shift = self.length % 8
+        if shift == 0 or other.length == 0:
+            return BitBuffer(np.concatenate([self.data, other.data]), self.length + other.length)
+
+        tail = other.data.astype(np.uint16)
+        shifted = np.zeros(len(tail) + 1, dtype=np.uint16)
+        shifted[:-1] = tail >> shift
+        shifted[1:] |= (tail << (8 - shift)) & 0xFF
+
+        data = np.concatenate([self.data, shifted[1:].astype(np.uint8)])
+        data[len(self.data) - 1] |= shifted[0]
+
+        return BitBuffer(data, self.length + other.length)
+
+    # ==================== 轉換 ====================
+    def unpack(self):
+        """
+        功能:
+            展開成 0/1 的 uint8 陣列
+        """
+        return np.unpackbits(self.data, count=self.length)
+
+    def tolist(self):
+        """
+        功能:
+            轉回 Python int 列表（舊介面相容用）
+        """
+        return self.unpack().tolist()
+
+    def to_bytes(self):
+        """
+        功能:
+            取得打包後的 bytes（最後不足 8 bits 的部分補 0）
+        """
+        return self.data.tobytes()
+
+    def __array__(self, dtype=None, copy=None):
+        bits = self.unpack()
+        return bits if dtype is None else bits.astype(dtype)
+
+    # ==================== 序列操作 ====================
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return BitBuffer.from_bits(self.unpack()[index])
+            stop = max(start, stop)
+            if start % 8 == 0:
+                # 從整 byte 開始，直接切打包資料
+                return BitBuffer(self.data[start // 8:], stop - start)
+            chunk = np.unpackbits(self.data[start // 8:-(-stop // 8)])
+            offset = start % 8
+            return BitBuffer.from_bits(chunk[offset:offset + stop - start])
+
+        index = int(index)
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("BitBuffer 索引超出範圍")
+        return int(self.data[index // 8] >> (7 - index % 8)) & 1
+
+    def __add__(self, other):
+        return BitBuffer.concat([self, other])
+
+    def __radd__(self, other):
+        return BitBuffer.concat([other, self])
+
+    def __eq__(self, other):
+        if isinstance(other, BitBuffer):
+            return self.length == other.length and np.array_equal(self.data, other.data)
+        if isinstance(other, (list, tuple, np.ndarray)):
+            return self.length == len(other) and np.array_equal(self.unpack(), np.asarray(other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"BitBuffer(length={self.length}, bytes={len(self.data)})"
+
+
+def as_bit_array(bits):
+    """
+    功能:
+        把位元列表、陣列或 BitBuffer 統一轉成 0/1 的 uint8 陣列
+
+    參數:
+        bits: 位元序列
+
+    返回:
+        bit_array: 一維 uint8 陣列
+    """
+    if isinstance(bits, BitBuffer):
+        return bits.unpack()
+    return np.asarray(bits, dtype=np.uint8).reshape(-1)
+
+
+def bytes_to_bits(data):
+    """
+    功能:
+        bytes 展開成 0/1 的 uint8 陣列（每 byte 8 bits，MSB first）
+    """
+    return np.unpackbits(np.frombuffer(bytes(data), dtype=np.uint8))
+
+
+def bits_to_bytes(bits):
+    """
+    功能:
+        位元序列每 8 bits 組成 1 byte，尾端不足 8 bits 的部分捨棄
+
+    參數:
+        bits: 位元列表、陣列或 BitBuffer
+
+    返回:
+        data: bytes
+    """
+    if isinstance(bits, BitBuffer):
+        return bits.data[:bits.length // 8].tobytes()
+    bits = as_bit_array(bits)
+    return np.packbits(bits[:len(bits) - len(bits) % 8]).tobytes()
+
+
+def iter_byte_chunks(source, chunk_size):
+    """
+    功能:
+        將各種資料來源（機密內容、Z 碼檔案等）統一轉成一段段的 bytes
+
+    參數:
+        source: str / bytes、檔案類物件（有 read 方法）、或產生 str / bytes 片段的可迭代物件
+        chunk_size: 每段的 bytes 數（檔案類物件每次讀取的量）
+
+    返回:
+        產生器，依序產生 bytes（str 一律以 UTF-8 編碼）
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        return
+
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else bytes(chunk)
+
+    for chunk in source:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else bytes(chunk)
+
+
+def source_byte_length(source):
+    """
+    功能:
+        不讀取內容，取得資料來源剩下的 bytes 數（iter_byte_chunks 會產生的總長度）
+
+    參數:
+        source: 同 iter_byte_chunks
+
+    返回:
+        length: bytes 數；str / bytes 與可 seek 的二進位檔案可得知，其他來源（文字檔、可迭代物件、
+                socket 等）返回 None
+
+    注意:
+        檔案以 seek 到結尾再回到原位置取得長度，不改變目前的讀取位置
+    """
+    if isinstance(source, str):
+        return len(source.encode('utf-8'))
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+
+    if hasattr(source, 'read') and not isinstance(source, io.TextIOBase):
+        try:
+            if not source.seekable():
+                return None
+            position = source.tell()
+            end = source.seek(0, io.SEEK_END)
+            source.seek(position)
+            return end - position
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    return None
@@ -0,0 +1,57 @@
+# block_engine.py → 區塊向量化引擎模組
+# 以 NumPy 陣列運算一次處理所有需要的 8×8 區塊（載體預處理、Q 與 21 個平均值的 MSB）
+# 結果與逐區塊呼叫 generate_Q_from_block / calculate_hierarchical_averages 的流程逐位元相同
+
+import numpy as np
+
+from config import Q_LENGTH
+from permutation import generate_Q_matrix
+from image_processing import calculate_all_averages
+from grayscale import to_grayscale
+
+def prepare_cover(cover_image, strict=True):
+    """
+    功能:
+        載體圖片預處理：彩色轉灰階並檢查尺寸
+
+    參數:
+        cover_image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)
+        strict: True 時尺寸不是 8 的倍數會報錯；False 時直接裁掉不足一個區塊的邊緣
+
+    返回:
+        cover_gray: 灰階圖片 (H×W)
+    """
+    # 若為彩色圖片，轉成灰階
+    cover_image = to_grayscale(np.array(cover_image))
+
+    height, width = cover_image.shape
+
+    # 檢查圖片大小是否為 8 的倍數
+    if height % 8 != 0 or width % 8 != 0:
+        if strict:
+            raise ValueError(f"圖片大小必須是 8 的倍數！當前大小: {width}×{height}")
+        cover_image = cover_image[:height - height % 8, :width - width % 8]
+
+    return cover_image
+
+
+def compute_block_msbs(cover_gray):
+    """
+    功能:
+        一次計算所有 8×8 區塊未排列的 21 個 MSB 與不含 contact_key 置換的 Q
+        （CoverIndex 建立索引與只讀取部分區塊列的提取都使用這個函數）
+
+    參數:
+        cover_gray: 灰階圖片 (H×W) 或其中連續的區塊列，H 與 W 皆為 8 的倍數
+
+    返回:
+        msb_packed: (區塊數, 3) uint8，21 個平均值的 MSB（np.packbits 打包）
+        base_Q: (區塊數, 7) uint8，每個區塊第一行前 7 個像素的排序（1-based）
+
+    原理:
+        1. 每個區塊第一行前 7 個像素做 argsort 得到 Q（與 generate_Q_from_block 相同）
+        2. 21 個平均值 >= 128 即 MSB = 1
+        contact_key 置換與 Q 的 3 輪展開與密鑰有關，由 CoverIndex.block_msbs 在使用時套用
+    """
+    averages = calculate_all_averages(cover_gray)
+    return np.packbits(averages >= 128, axis=1), generate_Q_matrix(cover_gray, Q_LENGTH)
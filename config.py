@@ -1,6 +1,8 @@
 
 # 建立 config.py → 配置模組
 
+import os
+
 # 專案資訊
 PROJECT_NAME = 'E-CIHMSB Steganography'
 VERSION = '2.0.0'
@@ -41,6 +43,11 @@ REVERSE_MAPPING_TABLE = {
     (0, 1): 0
 }
 
+# 多載體分片 header：分片編號 8 bits + 分片總數 8 bits + 本片內容位元數 32 bits = 48 bits
+SHARD_HEADER_FORMAT = '>BBI'
+SHARD_HEADER_BITS = 48
+MAX_SHARDS = 255
+
 # 測試資料(論文的圖2)
 TEST_IMAGE = [
     [44, 61, 72, 58, 70, 79, 66, 79],
@@ -55,6 +62,60 @@ TEST_IMAGE = [
 
 TEST_SECRET = "H"  # 測試秘密訊息
 
+# 圖片庫：可選的載體尺寸與各風格的 Pexels 圖片
+AVAILABLE_SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
+
+IMAGE_LIBRARY = {
+    "建築": [
+        {"id": 29493117, "name": "哈里發塔"},
+        {"id": 34132869, "name": "比薩斜塔"},
+        {"id": 16457365, "name": "埃菲爾鐵塔"},
+        {"id": 236294, "name": "聖彼得大教堂"},
+        {"id": 16681013, "name": "謝赫扎耶德大清真寺"},
+        {"id": 29144355, "name": "熨斗大樓"},
+        {"id": 1650904, "name": "泰坦尼克博物館"},
+    ],
+    "動物": [
+        {"id": 1108099, "name": "拉布拉多"},
+        {"id": 568022, "name": "白羊"},
+        {"id": 19613749, "name": "兔子"},
+        {"id": 7060929, "name": "刺蝟"},
+        {"id": 19597261, "name": "松鼠"},
+        {"id": 10386190, "name": "梅花鹿"},
+        {"id": 34954771, "name": "栗頭蜂虎"},
+    ],
+    "植物": [
+        {"id": 1048024, "name": "仙人掌"},
+        {"id": 11259955, "name": "雛菊"},
+        {"id": 6830332, "name": "櫻花"},
+        {"id": 7048610, "name": "鬱金香"},
+        {"id": 18439973, "name": "洋牡丹"},
+        {"id": 244796, "name": "木槿花"},
+        {"id": 206837, "name": "勿忘我"},
+    ],
+    "食物": [
+        {"id": 28503601, "name": "海鮮燉飯"},
+        {"id": 32538755, "name": "紅醬義大利麵"},
+        {"id": 1566837, "name": "比薩"},
+        {"id": 7245468, "name": "壽司"},
+        {"id": 4110272, "name": "水果拼盤"},
+        {"id": 6441084, "name": "草莓蛋糕"},
+        {"id": 7144558, "name": "鬆餅"},
+    ],
+    "交通": [
+        {"id": 33435422, "name": "摩托車"},
+        {"id": 1595483, "name": "自行車"},
+        {"id": 2263673, "name": "巴士"},
+        {"id": 33519108, "name": "火車"},
+        {"id": 33017407, "name": "飛機"},
+        {"id": 843633, "name": "遊艇"},
+        {"id": 586040, "name": "火箭"},
+    ],
+}
+
+# 載體索引檔目錄（多個服務副本可指向同一個共享目錄；設為空字串則停用磁碟索引）
+COVER_INDEX_DIR = os.environ.get('COVER_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cover_index'))
+
 def calculate_capacity(image_width, image_height):
   """
   功能:
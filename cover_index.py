@@ -0,0 +1,467 @@
+# cover_index.py → 載體索引模組
+# 21 個平均值的 MSB 與每個區塊第一行的排序只跟載體圖片有關，跟對象密鑰無關。
+# 先把它們算好存起來，之後任何 contact_key 的嵌入/提取都只需要一次 gather + 查表。
+
+import os
+import sys
+import struct
+import hashlib
+import argparse
+import secrets
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import BLOCK_SIZE, Q_LENGTH, TOTAL_AVERAGES_PER_UNIT, COVER_INDEX_DIR
+from block_engine import prepare_cover
+from permutation import get_key_permutation, apply_Q_three_rounds_batch
+from parallel import compute_index_arrays
+from tiled_cover import TILED_STRIP_ROWS, open_cover_pixels, cover_dimensions, iter_gray_strips
+from mapping import map_to_z_array, map_from_z_array
+from bit_buffer import as_bit_array
+
+# 記憶體快取最多保留的載體數量（圖片庫 35 張 × 7 種尺寸中常用的部分）
+COVER_INDEX_CACHE_SIZE = 64
+
+# 索引檔權限（實際權限再扣掉程序的 umask），建置索引與執行介面的使用者不同時也能讀取
+COVER_INDEX_FILE_MODE = 0o644
+
+# 索引檔格式（小端序，header 固定 64 bytes，之後依序為 msb_packed 與 base_Q）
+#   magic 4 bytes | 版本 2 bytes | 保留 2 bytes | 高 4 bytes | 寬 4 bytes | 區塊數 4 bytes | SHA-256 32 bytes
+# 計算方式改變時調高 COVER_INDEX_VERSION，舊檔會自動忽略並重建
+COVER_INDEX_MAGIC = b'ECIX'
+COVER_INDEX_VERSION = 1
+COVER_INDEX_HEADER_FORMAT = '<4sHHIII32s'
+COVER_INDEX_HEADER_BYTES = 64
+COVER_INDEX_SUFFIX = '.ecix'
+MSB_BYTES_PER_UNIT = (TOTAL_AVERAGES_PER_UNIT + 7) // 8
+
+class CoverIndex:
+    """
+    功能:
+        一張載體圖片與密鑰無關的預先計算結果
+
+    屬性:
+        height, width: 載體尺寸（8 的倍數）
+        msb_packed: (區塊數, 3) uint8，每個區塊 21 個平均值的 MSB（未排列，np.packbits 打包）
+        base_Q: (區塊數, 7) uint8，每個區塊不含 contact_key 置換的 Q (1-based 索引)
+        content_hash: 灰階載體內容的 SHA-256（十六進位字串）
+
+    用法:
+        index = CoverIndex.from_image(cover_image)
+        z = index.embed_bits(secret_bits, contact_key)
+        bits = index.extract_bits(z, contact_key)
+    """
+
+    def __init__(self, height, width, msb_packed, base_Q, content_hash=None):
+        self.height = height
+        self.width = width
+        self.msb_packed = msb_packed
+        self.base_Q = base_Q
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_image(cls, cover_image, strict=True):
+        """
+        功能:
+            由載體圖片建立索引（會先做彩色轉灰階與尺寸檢查）
+        """
+        cover_gray = prepare_cover(cover_image, strict=strict)
+        return cls.from_gray(cover_gray)
+
+    @classmethod
+    def from_gray(cls, cover_gray, content_hash=None, workers=None):
+        """
+        功能:
+            由已預處理的灰階載體建立索引（workers > 1 時依區塊列分段平行計算，結果相同）
+        """
+        height, width = cover_gray.shape
+        msb_packed, base_Q = compute_index_arrays(cover_gray, workers)
+
+        if content_hash is None:
+            content_hash = cover_content_hash(cover_gray)
+
+        return cls(height, width, msb_packed, base_Q, content_hash)
+
+    @classmethod
+    def from_strips(cls, cover_source, strict=True, strip_rows=TILED_STRIP_ROWS):
+        """
+        功能:
+            逐條讀取超大載體並建立索引，峰值記憶體只與橫條大小有關
+            （結果與 from_image 完全相同，包含內容雜湊）
+
+        參數:
+            cover_source: numpy array / np.memmap、.npy 檔、圖片檔路徑或 PIL Image（見 tiled_cover.open_cover_pixels）
+            strict: True 時尺寸不是 8 的倍數會報錯；False 時裁掉邊緣
+            strip_rows: 每條的列數（8 的倍數）
+        """
+        pixels = open_cover_pixels(cover_source)
+        height, width = cover_dimensions(pixels, strict)
+        num_cols = width // BLOCK_SIZE
+        num_units = (height // BLOCK_SIZE) * num_cols
+
+        msb_packed = np.empty((num_units, MSB_BYTES_PER_UNIT), dtype=np.uint8)
+        base_Q = np.empty((num_units, Q_LENGTH), dtype=np.uint8)
+        hasher = _content_hasher(height, width)
+
+        for top, strip in iter_gray_strips(pixels, strict, strip_rows):
+            strip = np.ascontiguousarray(strip, dtype=np.uint8)
+            hasher.update(strip.data)
+
+            unit_start = (top // BLOCK_SIZE) * num_cols
+            unit_stop = unit_start + (strip.shape[0] // BLOCK_SIZE) * num_cols
+            msb_packed[unit_start:unit_stop], base_Q[unit_start:unit_stop] = compute_index_arrays(strip)
+
+        return cls(height, width, msb_packed, base_Q, hasher.hexdigest())
+
+    def save(self, path):
+        """
+        功能:
+            將索引寫成版本化的二進位檔（先寫暫存檔再改名，多個程序同時寫入也安全）
+
+        注意:
+            暫存檔以 COVER_INDEX_FILE_MODE 建立（由系統扣掉 umask，即 0o644 & ~umask），
+            不使用 tempfile.mkstemp 的 0600，改名後其他使用者與其他副本仍可讀取
+        """
+        header = struct.pack(
+            COVER_INDEX_HEADER_FORMAT, COVER_INDEX_MAGIC, COVER_INDEX_VERSION, 0,
+            self.height, self.width, self.num_units, bytes.fromhex(self.content_hash)
+        ).ljust(COVER_INDEX_HEADER_BYTES, b'\0')
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{os.path.basename(path)}.{secrets.token_hex(8)}.tmp")
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), COVER_INDEX_FILE_MODE)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.write(np.ascontiguousarray(self.msb_packed, dtype=np.uint8).tobytes())
+                f.write(np.ascontiguousarray(self.base_Q, dtype=np.uint8).tobytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        功能:
+            以記憶體映射 (mmap) 載入索引檔，資料不會整個讀進記憶體
+
+        返回:
+            index: CoverIndex；檔案格式或版本不符時返回 None
+        """
+        with open(path, 'rb') as f:
+            header = f.read(COVER_INDEX_HEADER_BYTES)
+        if len(header) < COVER_INDEX_HEADER_BYTES:
+            return None
+
+        magic, version, _, height, width, num_units, digest = struct.unpack_from(COVER_INDEX_HEADER_FORMAT, header)
+        if magic != COVER_INDEX_MAGIC or version != COVER_INDEX_VERSION or num_units == 0:
+            return None
+        if num_units != (height // BLOCK_SIZE) * (width // BLOCK_SIZE):
+            return None
+        msb_offset = COVER_INDEX_HEADER_BYTES
+        q_offset = msb_offset + num_units * MSB_BYTES_PER_UNIT
+        if os.path.getsize(path) != q_offset + num_units * Q_LENGTH:
+            return None
+
+        msb_packed = np.memmap(path, dtype=np.uint8, mode='r', offset=msb_offset, shape=(num_units, MSB_BYTES_PER_UNIT))
+        base_Q = np.memmap(path, dtype=np.uint8, mode='r', offset=q_offset, shape=(num_units, Q_LENGTH))
+
+        return cls(height, width, msb_packed, base_Q, digest.hex())
+
+    @property
+    def num_units(self):
+        return (self.height // BLOCK_SIZE) * (self.width // BLOCK_SIZE)
+
+    @property
+    def capacity(self):
+        return self.num_units * TOTAL_AVERAGES_PER_UNIT
+
+    def raw_msbs(self, start=0, stop=None):
+        """
+        功能:
+            取得第 start 到 stop 個區塊未排列的 21 個 MSB（與密鑰無關，可給多個密鑰共用）
+        """
+        return np.unpackbits(self.msb_packed[start:stop], axis=1, count=TOTAL_AVERAGES_PER_UNIT)
+
+    def block_msbs(self, contact_key=None, start=0, stop=None, raw_msbs=None):
+        """
+        功能:
+            取得第 start 到 stop 個區塊依 Q（含 contact_key 置換）排列後的 21 個 MSB
+
+        參數:
+            contact_key: 對象專屬密鑰（字串）
+            start, stop: 區塊範圍（依列優先順序），stop 省略代表到最後
+            raw_msbs: 已由 raw_msbs(start, stop) 取得的未排列 MSB，省略時重新展開
+
+        返回:
+            msbs: (區塊數, 21) uint8 陣列
+        """
+        if stop is None:
+            stop = self.num_units
+
+        msbs = self.raw_msbs(start, stop) if raw_msbs is None else raw_msbs
+        Q_matrix = self.base_Q[start:stop]
+
+        perm_order = get_key_permutation(contact_key, Q_LENGTH)
+        if perm_order is not None:
+            Q_matrix = Q_matrix[:, list(perm_order)]
+
+        return apply_Q_three_rounds_batch(msbs, Q_matrix)
+
+    def embed_bits(self, secret_bits, contact_key=None):
+        """
+        功能:
+            將秘密位元映射成 Z 碼（不做容量檢查）
+        """
+        secret_bits = as_bit_array(secret_bits)
+        num_bits = len(secret_bits)
+        num_blocks = -(-num_bits // TOTAL_AVERAGES_PER_UNIT)
+
+        msbs = self.block_msbs(contact_key, 0, num_blocks).reshape(-1)[:num_bits]
+
+        return map_to_z_array(secret_bits, msbs)
+
+    def extract_bits(self, z_bits, contact_key=None):
+        """
+        功能:
+            由 Z 碼還原秘密位元，超過容量的部分忽略
+        """
+        z_bits = as_bit_array(z_bits)
+        num_bits = min(len(z_bits), self.capacity)
+        num_blocks = -(-num_bits // TOTAL_AVERAGES_PER_UNIT)
+
+        msbs = self.block_msbs(contact_key, 0, num_blocks).reshape(-1)[:num_bits]
+
+        return map_from_z_array(z_bits[:num_bits], msbs)
+
+    def read_type_marker(self, z_bits, contact_key=None):
+        """
+        功能:
+            只用第一個區塊還原第 1 bit 類型標記
+        """
+        msbs = self.block_msbs(contact_key, 0, 1)
+
+        return int(map_from_z_array(as_bit_array(z_bits[:1]), msbs[0, :1])[0])
+
+
+def cover_content_hash(cover_gray):
+    """
+    功能:
+        計算灰階載體內容的雜湊（含尺寸），作為快取鍵
+    """
+    cover_gray = np.ascontiguousarray(cover_gray, dtype=np.uint8)
+    hasher = _content_hasher(*cover_gray.shape)
+    hasher.update(cover_gray.data)
+
+    return hasher.hexdigest()
+
+
+def _content_hasher(height, width):
+    """
+    功能:
+        建立內容雜湊的 hasher（先放入尺寸，之後依列優先順序放入灰階像素）
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{height}x{width}".encode('ascii'))
+    return hasher
+
+
+def cover_index_path(content_hash, index_dir=None):
+    """
+    功能:
+        取得某張載體索引檔的路徑（檔名即內容雜湊）
+    """
+    index_dir = COVER_INDEX_DIR if index_dir is None else index_dir
+    return os.path.join(index_dir, content_hash + COVER_INDEX_SUFFIX)
+
+
+def load_or_build_cover_index(cover_gray, content_hash=None, index_dir=None, workers=None, persist=False):
+    """
+    功能:
+        先找磁碟上的索引檔（mmap 載入），沒有或版本不符時重新計算；persist=True 時才寫入磁碟
+
+    參數:
+        cover_gray: 已預處理的灰階載體
+        content_hash: 灰階載體內容雜湊，省略時自動計算
+        index_dir: 索引檔目錄，省略時使用 config.COVER_INDEX_DIR；空字串代表不使用磁碟
+        workers: 需要重新計算時使用的程序數量（None 或 1 為單核心，0 為全部 CPU）
+        persist: True 時把重新計算的索引寫入磁碟（只給圖片庫載體與預建工具使用；
+                 使用者上傳的任意載體不寫檔，否則索引目錄會隨上傳次數無限增長）
+
+    返回:
+        index: CoverIndex
+    """
+    if content_hash is None:
+        content_hash = cover_content_hash(cover_gray)
+    index_dir = COVER_INDEX_DIR if index_dir is None else index_dir
+
+    if not index_dir or cover_gray.size == 0:
+        return CoverIndex.from_gray(cover_gray, content_hash, workers)
+
+    path = cover_index_path(content_hash, index_dir)
+    try:
+        index = CoverIndex.load(path)
+        if index is not None and index.content_hash == content_hash:
+            return index
+    except (OSError, ValueError, struct.error):
+        pass
+
+    index = CoverIndex.from_gray(cover_gray, content_hash, workers)
+    if persist:
+        try:
+            index.save(path)
+        except OSError:
+            # 目錄唯讀或空間不足時只用記憶體中的索引
+            pass
+
+    return index
+
+
+_index_cache = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+def get_cover_index(cover_image, strict=True, workers=None, persist=False):
+    """
+    功能:
+        取得載體索引；同一張載體（內容相同）只計算一次：
+        先查記憶體 LRU 快取，再查磁碟索引檔，都沒有才重新計算
+        （重新計算的結果只放在記憶體 LRU，persist=True 時才寫入磁碟）
+
+    參數:
+        cover_image: 載體圖片（numpy array / PIL Image），或已建立的 CoverIndex；
+                     也可以是圖片檔 / .npy 檔路徑或 np.memmap，此時逐條讀取（適合超大載體）
+        strict: True 時尺寸不是 8 的倍數會報錯；False 時裁掉邊緣
+        workers: 需要重新計算時使用的程序數量（None 或 1 為單核心，0 為全部 CPU）
+        persist: True 時把索引寫入 config.COVER_INDEX_DIR（只用於圖片庫載體）
+
+    返回:
+        index: CoverIndex
+    """
+    if isinstance(cover_image, CoverIndex):
+        return cover_image
+
+    if isinstance(cover_image, (str, os.PathLike, np.memmap)):
+        # 超大載體：讀一次檔案就同時得到索引與內容雜湊
+        index = CoverIndex.from_strips(cover_image, strict=strict)
+        with _index_cache_lock:
+            cached = _index_cache.get(index.content_hash)
+        if cached is None:
+            if persist:
+                _save_if_missing(index)
+            cached = index
+        return _remember_cover_index(cached)
+
+    cover_gray = prepare_cover(cover_image, strict=strict)
+    content_hash = cover_content_hash(cover_gray)
+
+    with _index_cache_lock:
+        index = _index_cache.get(content_hash)
+    if index is None:
+        index = load_or_build_cover_index(cover_gray, content_hash, workers=workers, persist=persist)
+    elif persist:
+        _save_if_missing(index)
+
+    return _remember_cover_index(index)
+
+
+def _remember_cover_index(index):
+    """
+    功能:
+        將索引放進記憶體 LRU 快取（已存在時移到最新）
+    """
+    with _index_cache_lock:
+        _index_cache[index.content_hash] = index
+        _index_cache.move_to_end(index.content_hash)
+        while len(_index_cache) > COVER_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+
+    return index
+
+
+def _save_if_missing(index, index_dir=None):
+    """
+    功能:
+        磁碟上還沒有這張載體的索引檔時寫入（目錄唯讀或空間不足時略過）
+    """
+    index_dir = COVER_INDEX_DIR if index_dir is None else index_dir
+    if not index_dir or index.num_units == 0:
+        return
+
+    path = cover_index_path(index.content_hash, index_dir)
+    if os.path.exists(path):
+        return
+    try:
+        index.save(path)
+    except OSError:
+        pass
+
+
+def clear_cover_index_cache():
+    """
+    功能:
+        清空記憶體中的載體索引快取（磁碟上的索引檔不受影響）
+    """
+    with _index_cache_lock:
+        _index_cache.clear()
+
+
+def build_library_indexes(index_dir=None, sizes=None):
+    """
+    功能:
+        為圖片庫 (IMAGE_LIBRARY) 每張圖片的每種尺寸預先建立磁碟索引檔
+
+    參數:
+        index_dir: 索引檔目錄，省略時使用 config.COVER_INDEX_DIR
+        sizes: 要建立的尺寸列表，省略時使用 AVAILABLE_SIZES
+
+    返回:
+        built: 成功建立（或已存在）的索引數量
+        failed: 下載失敗的 (風格, 圖像編號, 尺寸) 列表
+    """
+    from config import AVAILABLE_SIZES
+    from image_library import iter_library_images, fetch_library_image, decode_library_image
+
+    sizes = AVAILABLE_SIZES if sizes is None else sizes
+    built, failed = 0, []
+
+    for style_name, img_num, entry in iter_library_images():
+        for size in sizes:
+            image_data = fetch_library_image(entry["id"], size)
+            if not image_data:
+                failed.append((style_name, img_num, size))
+                print(f"  ✗ {style_name} {img_num}（{entry['name']}）{size}×{size}：下載失敗")
+                continue
+
+            _, img_gray = decode_library_image(image_data, size)
+            cover_gray = prepare_cover(img_gray)
+            index = load_or_build_cover_index(cover_gray, index_dir=index_dir, persist=True)
+            built += 1
+            print(f"  ✓ {style_name} {img_num}（{entry['name']}）{size}×{size} → {index.content_hash[:12]}")
+
+    return built, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預先建立圖片庫載體索引檔")
+    parser.add_argument('--dir', default=None, help=f"索引檔目錄（預設: {COVER_INDEX_DIR}）")
+    parser.add_argument('--sizes', type=int, nargs='+', default=None, help="只建立指定尺寸（預設: 全部 AVAILABLE_SIZES）")
+    args = parser.parse_args(argv)
+
+    index_dir = args.dir or COVER_INDEX_DIR
+    if not index_dir:
+        parser.error("未設定索引檔目錄（COVER_INDEX_DIR 為空字串）")
+
+    print(f"索引檔目錄: {index_dir}")
+    built, failed = build_library_indexes(index_dir, args.sizes)
+    print(f"完成: {built} 個索引，{len(failed)} 個下載失敗")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,129 +1,346 @@
 # embed.py → 嵌入模組（支援文字和圖片，含對象密鑰）
 
+import struct
 import numpy as np
 
-from config import Q_LENGTH, TOTAL_AVERAGES_PER_UNIT, BLOCK_SIZE, calculate_capacity
-from permutation import generate_Q_from_block, apply_Q_three_rounds
-from image_processing import calculate_hierarchical_averages
-from binary_operations import get_msbs
-from mapping import map_to_z
+from config import BLOCK_SIZE, TOTAL_AVERAGES_PER_UNIT, SHARD_HEADER_FORMAT, SHARD_HEADER_BITS, MAX_SHARDS
+from cover_index import get_cover_index
+from parallel import thread_map
+from mapping import map_to_z_array
+from bit_buffer import BitBuffer, as_bit_array, iter_byte_chunks, source_byte_length
 from secret_encoding import text_to_binary, image_to_binary
 
-def embed_secret(cover_image, secret, secret_type='text', contact_key=None):
+def encode_secret_bits(secret, secret_type, capacity):
+    """
+    功能:
+        將機密內容轉成 [1 bit 類型標記] + [機密內容] 的位元陣列，並檢查容量
+
+    參數:
+        secret: 機密內容（字串或 PIL Image）
+        secret_type: 'text' 或 'image'
+        capacity: 載體容量（bits）
+
+    返回:
+        secret_bits: 0/1 的 uint8 陣列
+        info: 機密內容的相關資訊
+    """
+    if secret_type == 'text':
+        type_marker = [0]  # 0 = 文字
+        content_bits = text_to_binary(secret, packed=True)
+        info = {'type': 'text', 'length': len(secret), 'bits': len(content_bits) + 1}
+    else:
+        type_marker = [1]  # 1 = 圖片
+        content_bits, orig_size, mode = image_to_binary(secret, capacity - 1, packed=True)  # 預留 1 bit 給類型標記
+        info = {'type': 'image', 'size': orig_size, 'mode': mode, 'bits': len(content_bits) + 1}
+    
+    # 組合完整的 secret_bits
+    secret_bits = np.concatenate([np.array(type_marker, dtype=np.uint8), as_bit_array(content_bits)])
+    
+    # 檢查容量是否足夠
+    if len(secret_bits) > capacity:
+        raise ValueError(
+            f"機密內容太大！需要 {len(secret_bits)} bits，但容量只有 {capacity} bits"
+        )
+    
+    return secret_bits, info
+
+
+def embed_secret(cover_image, secret, secret_type='text', contact_key=None, packed=False, workers=None):
     """
     功能:
         將機密內容嵌入無載體圖片，產生 Z 碼
     
     參數:
-        cover_image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)
+        cover_image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)，或已建立的 CoverIndex
         secret: 機密內容（字串或 PIL Image）
         secret_type: 'text' 或 'image'
         contact_key: 對象專屬密鑰（字串），用於加密
+        packed: True 時返回 BitBuffer（每 bit 只佔 1/8 byte），False 時返回位元列表
+        workers: 載體第一次計算時使用的程序數量（None 或 1 為單核心，0 為全部 CPU），結果與單核心相同
     
     返回:
-        z_bits: Z 碼位元列表
+        z_bits: Z 碼（位元列表或 BitBuffer）
         capacity: 圖片的總容量
         info: 額外資訊（機密內容的相關資訊）
     
     流程:
-        1. 圖片預處理（彩色轉灰階、檢查尺寸）
+        1. 圖片預處理（彩色轉灰階、檢查尺寸），取得載體索引
         2. 計算容量並檢查
-        3. 對每個 8×8 區塊進行嵌入（使用 contact_key 生成 Q）
+        3. 一次對所有需要的 8×8 區塊進行嵌入（使用 contact_key 置換 Q）
     
     格式:
         [1 bit 類型標記] + [機密內容]
         類型標記: 0 = 文字, 1 = 圖片
     """
-    cover_image = np.array(cover_image)
-    
     # ========== 步驟 1：圖片預處理 ==========
-    # 1.1 若為彩色圖片，轉成灰階
-    if len(cover_image.shape) == 3:
-        cover_image = (
-            0.299 * cover_image[:, :, 0] + 
-            0.587 * cover_image[:, :, 1] + 
-            0.114 * cover_image[:, :, 2]
-        ).astype(np.uint8)
-    
-    height, width = cover_image.shape
-    
-    # 1.2 檢查圖片大小是否為 8 的倍數
-    if height % 8 != 0 or width % 8 != 0:
-        raise ValueError(f"圖片大小必須是 8 的倍數！當前大小: {width}×{height}")
+    # 彩色轉灰階、檢查圖片大小是否為 8 的倍數，取得與密鑰無關的載體索引（同一張載體只算一次）
+    index = get_cover_index(cover_image, workers=workers)
     
     # ========== 步驟 2：計算容量並檢查 ==========
-    # 2.1 計算 8×8 區塊數量
-    num_rows = height // BLOCK_SIZE
-    num_cols = width // BLOCK_SIZE
-    num_units = num_rows * num_cols
+    # 2.1 計算容量: 8×8 區塊數量 × 21
+    capacity = index.capacity
     
-    # 2.2 計算容量
-    capacity = num_units * TOTAL_AVERAGES_PER_UNIT
+    # 2.2 將機密內容轉成二進位（加入類型標記），並檢查容量是否足夠
+    secret_bits, info = encode_secret_bits(secret, secret_type, capacity)
     
-    # 2.3 將機密內容轉成二進位（加入類型標記）
-    if secret_type == 'text':
-        type_marker = [0]  # 0 = 文字
-        content_bits = text_to_binary(secret)
-        info = {'type': 'text', 'length': len(secret), 'bits': len(content_bits) + 1}
-    else:
-        type_marker = [1]  # 1 = 圖片
-        content_bits, orig_size, mode = image_to_binary(secret, capacity - 1)  # 預留 1 bit 給類型標記
-        info = {'type': 'image', 'size': orig_size, 'mode': mode, 'bits': len(content_bits) + 1}
-    
-    # 2.4 組合完整的 secret_bits
-    secret_bits = type_marker + content_bits
+    # ========== 步驟 3：一次對所有需要的 8×8 區塊進行嵌入 ==========
+    # 載體索引已有 MSB 與 Q，這裡只需依 contact_key 做 gather 與映射
+    z_bits = index.embed_bits(secret_bits, contact_key=contact_key)
+    z_bits = BitBuffer.from_bits(z_bits) if packed else z_bits.tolist()
     
-    # 2.5 檢查容量是否足夠
-    if len(secret_bits) > capacity:
+    return z_bits, capacity, info
+
+
+def embed_stream(cover_image, source, contact_key=None, workers=None):
+    """
+    功能:
+        串流嵌入：一次只處理一列 8×8 區塊，逐段產生打包後的 Z 碼，
+        不需要把整個機密內容或整個 Z 碼放在記憶體中
+
+    參數:
+        cover_image: 載體圖片，或已建立的 CoverIndex
+        source: 機密內容來源（見 iter_byte_chunks），內容以文字類型（類型標記 0）嵌入
+        contact_key: 對象專屬密鑰（字串）
+        workers: 載體第一次計算時使用的程序數量
+
+    返回:
+        產生器，依序產生 Z 碼的 bytes（MSB first，與 BitBuffer.to_bytes 相同），
+        最後一段不足 8 bits 的部分補 0；產生器結束時的返回值為 Z 碼位元數
+
+    注意:
+        所有片段接起來後，等於 embed_secret(cover_image, 文字, contact_key=..., packed=True).to_bytes()
+        來源長度已知時（str / bytes、可 seek 的二進位檔案），在產生第一段之前就檢查容量，
+        超過時拋出 ValueError、不產生任何片段；長度未知的來源（可迭代物件、socket、文字檔等）
+        只能在讀到超出的那一段才拋出 ValueError，此時之前的片段已經產生
+    """
+    index = get_cover_index(cover_image, workers=workers)
+    capacity = index.capacity
+
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    source_bytes = source_byte_length(source)
+    if source_bytes is not None and 1 + 8 * source_bytes > capacity:
         raise ValueError(
-            f"機密內容太大！需要 {len(secret_bits)} bits，但容量只有 {capacity} bits"
+            f"機密內容太大！需要 {1 + 8 * source_bytes} bits，但容量只有 {capacity} bits"
         )
-    
-    # ========== 步驟 3：對每個 8×8 區塊進行嵌入 ==========
-    z_bits = []
-    secret_bit_index = 0
-    finished = False
-    
-    for i in range(num_rows):
-        if finished:
+    row_bits = (index.width // BLOCK_SIZE) * TOTAL_AVERAGES_PER_UNIT
+
+    chunks = iter_byte_chunks(source, -(-row_bits // 8))
+    pending = np.zeros(1, dtype=np.uint8)  # 類型標記 0 = 文字
+    carry = np.zeros(0, dtype=np.uint8)  # 還湊不滿 1 byte 的 Z 碼位元
+    total_bits = 0
+    exhausted = False
+
+    while True:
+        # 補滿一列區塊需要的秘密位元
+        while not exhausted and len(pending) < row_bits:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            elif chunk:
+                pending = np.concatenate([pending, np.unpackbits(np.frombuffer(chunk, dtype=np.uint8))])
+
+        if len(pending) == 0:
             break
-        
-        for j in range(num_cols):
-            # 檢查是否所有 secret_bits 已處理完
-            if secret_bit_index >= len(secret_bits):
-                finished = True
-                break
-            
-            # 3.1 提取這個 8×8 區塊
-            start_row = i * BLOCK_SIZE
-            end_row = start_row + BLOCK_SIZE
-            start_col = j * BLOCK_SIZE
-            end_col = start_col + BLOCK_SIZE
-            block = cover_image[start_row:end_row, start_col:end_col]
-            
-            # 3.2 生成這個區塊專屬的排列密鑰 Q（加入 contact_key）
-            Q = generate_Q_from_block(block, Q_LENGTH, contact_key=contact_key)
-            
-            # 3.3 計算 21 個多層次平均值
-            averages_21 = calculate_hierarchical_averages(block)
-            
-            # 3.4 用 Q 重新排列 21 個平均值
-            reordered_averages = apply_Q_three_rounds(averages_21, Q)
-            
-            # 3.5 提取排列後的 21 個 MSB
-            msbs = get_msbs(reordered_averages)
-            
-            # 3.6 映射產生 Z 碼
-            for k in range(TOTAL_AVERAGES_PER_UNIT):
-                if secret_bit_index >= len(secret_bits):
-                    finished = True
-                    break
-                
-                secret_bit = secret_bits[secret_bit_index]
-                msb = msbs[k]
-                z_bit = map_to_z(secret_bit, msb)
-                z_bits.append(z_bit)
-                
-                secret_bit_index += 1
-    
-    return z_bits, capacity, info
+
+        bits, pending = pending[:row_bits], pending[row_bits:]
+        if total_bits + len(bits) > capacity:
+            raise ValueError(
+                f"機密內容太大！至少需要 {total_bits + len(bits)} bits，但容量只有 {capacity} bits"
+            )
+
+        start = total_bits // TOTAL_AVERAGES_PER_UNIT
+        stop = start + -(-len(bits) // TOTAL_AVERAGES_PER_UNIT)
+        msbs = index.block_msbs(contact_key, start, stop).reshape(-1)[:len(bits)]
+        total_bits += len(bits)
+
+        z_bits = np.concatenate([carry, map_to_z_array(bits, msbs)])
+        aligned = len(z_bits) - len(z_bits) % 8
+        carry = z_bits[aligned:]
+        if aligned:
+            yield np.packbits(z_bits[:aligned]).tobytes()
+
+    if len(carry):
+        yield np.packbits(carry).tobytes()
+
+    return total_bits
+
+
+def embed_stream_to(sink, cover_image, source, contact_key=None, workers=None):
+    """
+    功能:
+        串流嵌入並直接寫入 sink（檔案、BytesIO、socket 或可呼叫物件）
+
+    參數:
+        sink: 有 write 或 sendall 方法的物件，或接受 bytes 的函式
+        其餘參數同 embed_stream
+
+    返回:
+        z_length: Z 碼位元數（讀回時用 BitBuffer.from_bytes(資料, z_length)）
+        capacity: 圖片的總容量
+
+    注意:
+        來源長度已知時，容量不足會在寫入任何資料之前拋出 ValueError；
+        長度未知的來源在容量不足時，sink 中可能已經寫入部分（不完整、無法使用的）Z 碼，
+        呼叫端應在 ValueError 時捨棄 sink 的內容（例如寫入暫存檔，成功後再改名）
+    """
+    if hasattr(sink, 'write'):
+        write = sink.write
+    elif hasattr(sink, 'sendall'):
+        write = sink.sendall
+    else:
+        write = sink
+
+    index = get_cover_index(cover_image, workers=workers)
+    stream = embed_stream(index, source, contact_key=contact_key)
+
+    while True:
+        try:
+            chunk = next(stream)
+        except StopIteration as stop:
+            return stop.value, index.capacity
+        write(chunk)
+
+
+def embed_many(cover_image, items, packed=False, workers=None):
+    """
+    功能:
+        同一張載體一次嵌入多筆機密內容（載體只預處理一次，所有 Z 碼共用同一份 MSB）
+
+    參數:
+        cover_image: 載體圖片，或已建立的 CoverIndex
+        items: [(secret, secret_type, contact_key), ...]；secret_type、contact_key 可省略
+               （預設 'text'、None）
+        packed: True 時 Z 碼以 BitBuffer 返回
+        workers: 載體第一次計算時使用的程序數量
+
+    返回:
+        results: 與 items 順序相同的列表，每筆為
+                 成功: {'success': True, 'z_bits': Z 碼, 'capacity': 容量, 'info': 額外資訊}
+                 失敗: {'success': False, 'error': 錯誤訊息}（不影響其他筆）
+    """
+    index = get_cover_index(cover_image, workers=workers)
+
+    results = []
+    for item in items:
+        try:
+            secret, secret_type, contact_key = (tuple(item) + ('text', None))[:3]
+            z_bits, capacity, info = embed_secret(index, secret, secret_type, contact_key, packed=packed)
+            results.append({'success': True, 'z_bits': z_bits, 'capacity': capacity, 'info': info})
+        except Exception as e:
+            results.append({'success': False, 'error': str(e)})
+
+    return results
+
+
+def embed_for_contacts(cover_image, secret, contacts, secret_type='text', packed=False, workers=None):
+    """
+    功能:
+        同一份機密內容一次發給多個對象：內容只編碼一次、載體 MSB 只展開一次，
+        每個對象只需套用自己的 contact_key 置換（向量化 gather）與映射
+
+    參數:
+        cover_image: 載體圖片，或已建立的 CoverIndex
+        secret: 機密內容（字串或 PIL Image）
+        contacts: {對象名稱: contact_key} 或 {對象名稱: {"key": contact_key, ...}}（介面的對象資料格式），
+                  也可以是 (對象名稱, contact_key) 的列表
+        secret_type: 'text' 或 'image'
+        packed: True 時 Z 碼以 BitBuffer 返回
+        workers: 建立載體索引的平行數，以及同時處理的對象數（執行緒，共用同一份 MSB 不需複製；
+                 None 或 1 為依序處理，0 為全部 CPU）
+
+    返回:
+        z_codes: {對象名稱: Z 碼}，順序與 contacts 相同
+        capacity: 圖片的總容量
+        info: 機密內容的相關資訊
+
+    注意:
+        - 每個對象的 Z 碼與 embed_secret(cover_image, secret, secret_type, contact_key) 完全相同
+        - 對象資料是 dict 但沒有 "key" 時拋出 ValueError，不會默默產生沒有置換的 Z 碼
+    """
+    if isinstance(contacts, dict):
+        contacts = contacts.items()
+
+    def contact_key_of(name, data):
+        if not isinstance(data, dict):
+            return data
+        if not data.get("key"):
+            raise ValueError(f"對象「{name}」沒有密鑰 (key)")
+        return data["key"]
+
+    contacts = [(name, contact_key_of(name, data)) for name, data in contacts]
+
+    index = get_cover_index(cover_image, workers=workers)
+    capacity = index.capacity
+
+    secret_bits, info = encode_secret_bits(secret, secret_type, capacity)
+    num_bits = len(secret_bits)
+    num_blocks = -(-num_bits // TOTAL_AVERAGES_PER_UNIT)
+
+    # 所有對象共用的未排列 MSB
+    raw_msbs = index.raw_msbs(0, num_blocks)
+
+    def embed_one(contact):
+        name, contact_key = contact
+        msbs = index.block_msbs(contact_key, 0, num_blocks, raw_msbs=raw_msbs).reshape(-1)[:num_bits]
+        z_bits = map_to_z_array(secret_bits, msbs)
+        return name, (BitBuffer.from_bits(z_bits) if packed else z_bits.tolist())
+
+    z_codes = dict(thread_map(embed_one, contacts, workers))
+
+    return z_codes, capacity, info
+
+
+def embed_sharded(covers, secret, secret_type='text', contact_key=None, packed=False, workers=None):
+    """
+    功能:
+        將一份機密內容分片嵌入多張載體（依序填滿），突破單張載體的容量限制；
+        圖片機密只有在超過所有載體的總容量時才會縮小
+
+    參數:
+        covers: 載體圖片（或 CoverIndex）的有序列表，例如多張圖片庫圖片
+        secret: 機密內容（字串或 PIL Image）
+        secret_type: 'text' 或 'image'
+        contact_key: 對象專屬密鑰（字串）
+        packed: True 時 Z 碼以 BitBuffer 返回
+        workers: 同時處理的載體數（執行緒；None 或 1 為依序處理，0 為全部 CPU）
+
+    返回:
+        z_codes: 每個分片的 Z 碼列表，第 i 個對應 covers[i]；內容較小時只用到前面幾張載體，
+                 列表會比 covers 短（extract_sharded 直接接受同一份 covers）
+        capacity: 所有載體扣除分片 header 後的總容量
+        info: 機密內容的相關資訊（另含 'shards': 分片數量）
+
+    格式:
+        每個分片的秘密位元 = [48 bits 分片 header] + [完整秘密位元的一段]
+        分片 header: 分片編號 8 bits + 分片總數 8 bits + 本片內容位元數 32 bits
+        完整秘密位元與 embed_secret 相同：[1 bit 類型標記] + [機密內容]
+    """
+    indexes = thread_map(get_cover_index, covers, workers)
+    shard_capacities = [max(0, index.capacity - SHARD_HEADER_BITS) for index in indexes]
+    capacity = sum(shard_capacities)
+
+    secret_bits, info = encode_secret_bits(secret, secret_type, capacity)
+
+    # 依序切給每張載體
+    shards = []
+    position = 0
+    for index, shard_capacity in zip(indexes, shard_capacities):
+        if position >= len(secret_bits):
+            break
+        shards.append((index, secret_bits[position:position + shard_capacity]))
+        position += shard_capacity
+
+    if len(shards) > MAX_SHARDS:
+        raise ValueError(f"分片數量 {len(shards)} 超過上限 {MAX_SHARDS}")
+
+    def embed_shard(item):
+        shard_num, (index, payload) = item
+        header = BitBuffer.from_bytes(struct.pack(SHARD_HEADER_FORMAT, shard_num, len(shards), len(payload)))
+        z_bits = index.embed_bits(np.concatenate([header.unpack(), payload]), contact_key=contact_key)
+        return BitBuffer.from_bits(z_bits) if packed else z_bits.tolist()
+
+    z_codes = thread_map(embed_shard, enumerate(shards), workers)
+    info['shards'] = len(shards)
+
+    return z_codes, capacity, info
@@ -1,110 +1,35 @@
 # extract.py → 提取模組（支援文字和圖片，含對象密鑰）
 
+import codecs
+import struct
+
 import numpy as np
 
-from config import Q_LENGTH, TOTAL_AVERAGES_PER_UNIT, BLOCK_SIZE
-from permutation import generate_Q_from_block, apply_Q_three_rounds
-from image_processing import calculate_hierarchical_averages
-from binary_operations import get_msbs
-from mapping import map_from_z
+from config import BLOCK_SIZE, TOTAL_AVERAGES_PER_UNIT, SHARD_HEADER_FORMAT, SHARD_HEADER_BITS
+from cover_index import CoverIndex, get_cover_index
+from block_engine import compute_block_msbs
+from grayscale import to_grayscale
+from tiled_cover import open_cover_pixels, cover_dimensions, read_pixel_rows
+from parallel import thread_map
+from mapping import map_from_z_array
+from bit_buffer import BitBuffer, iter_byte_chunks
 from secret_encoding import binary_to_text, binary_to_image
 
-def extract_secret(cover_image, z_bits, secret_type='text', contact_key=None):
+def _decode_content(secret_bits, secret_type):
     """
     功能:
-        從 Z 碼和無載體圖片提取機密內容
+        跳過類型標記，將機密位元轉回原始內容（extract_secret 與 detect_and_extract 共用）
     
     參數:
-        cover_image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)
-        z_bits: Z 碼位元列表
+        secret_bits: 還原的秘密位元（含第 1 bit 類型標記）
         secret_type: 'text' 或 'image'
-        contact_key: 對象專屬密鑰（字串），用於解密
     
     返回:
         secret: 還原的機密內容（字串或 PIL Image）
         info: 額外資訊
-    
-    流程:
-        1. 圖片預處理（彩色轉灰階、檢查尺寸）
-        2. 計算 8×8 區塊數量
-        3. 對每個 8×8 區塊進行提取（使用 contact_key 生成 Q）
-        4. 跳過類型標記，將機密位元轉回原始內容
     """
-    cover_image = np.array(cover_image)
-    
-    # ========== 步驟 1：圖片預處理 ==========
-    # 1.1 若為彩色圖片，轉成灰階
-    if len(cover_image.shape) == 3:
-        cover_image = (
-            0.299 * cover_image[:, :, 0] + 
-            0.587 * cover_image[:, :, 1] + 
-            0.114 * cover_image[:, :, 2]
-        ).astype(np.uint8)
-    
-    height, width = cover_image.shape
-    
-    # 1.2 檢查圖片大小是否為 8 的倍數
-    if height % 8 != 0 or width % 8 != 0:
-        raise ValueError(f"圖片大小必須是 8 的倍數！當前大小: {width}×{height}")
-    
-    # ========== 步驟 2：計算 8×8 區塊數量 ==========
-    num_rows = height // BLOCK_SIZE
-    num_cols = width // BLOCK_SIZE
-    
-    # ========== 步驟 3：對每個 8×8 區塊進行提取 ==========
-    secret_bits = []
-    z_bit_index = 0
-    finished = False
-    
-    for i in range(num_rows):
-        if finished:
-            break
-        
-        for j in range(num_cols):
-            # 檢查是否所有 z_bits 已處理完
-            if z_bit_index >= len(z_bits):
-                finished = True
-                break
-            
-            # 3.1 提取這個 8×8 區塊
-            start_row = i * BLOCK_SIZE
-            end_row = start_row + BLOCK_SIZE
-            start_col = j * BLOCK_SIZE
-            end_col = start_col + BLOCK_SIZE
-            block = cover_image[start_row:end_row, start_col:end_col]
-            
-            # 3.2 生成這個區塊專屬的排列密鑰 Q（加入 contact_key）
-            Q = generate_Q_from_block(block, Q_LENGTH, contact_key=contact_key)
-            
-            # 3.3 計算 21 個多層次平均值
-            averages_21 = calculate_hierarchical_averages(block)
-            
-            # 3.4 用 Q 重新排列 21 個平均值
-            reordered_averages = apply_Q_three_rounds(averages_21, Q)
-            
-            # 3.5 提取排列後的 21 個 MSB
-            msbs = get_msbs(reordered_averages)
-            
-            # 3.6 反向映射還原機密位元
-            for k in range(TOTAL_AVERAGES_PER_UNIT):
-                if z_bit_index >= len(z_bits):
-                    finished = True
-                    break
-                
-                z_bit = z_bits[z_bit_index]
-                msb = msbs[k]
-                secret_bit = map_from_z(z_bit, msb)
-                secret_bits.append(secret_bit)
-                
-                z_bit_index += 1
-    
-    # ========== 步驟 4：將機密位元轉回原始內容 ==========
-    # 修正：跳過類型標記（第 1 bit）
-    if len(secret_bits) < 1:
-        raise ValueError("提取的位元數不足，無法讀取類型標記")
-    
-    type_marker = secret_bits[0]
-    content_bits = secret_bits[1:]  # ← 跳過類型標記！
+    type_marker = int(secret_bits[0])
+    content_bits = BitBuffer.from_bits(secret_bits[1:])  # ← 跳過類型標記！
     
     if secret_type == 'text':
         secret = binary_to_text(content_bits)
@@ -129,15 +54,50 @@ def extract_secret(cover_image, z_bits, secret_type='text', contact_key=None):
     return secret, info
 
 
-def detect_and_extract(cover_image, z_bits, contact_key=None):
+def extract_secret(cover_image, z_bits, secret_type='text', contact_key=None, workers=None):
+    """
+    功能:
+        從 Z 碼和無載體圖片提取機密內容
+    
+    參數:
+        cover_image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)，或已建立的 CoverIndex
+        z_bits: Z 碼（位元列表或 BitBuffer）
+        secret_type: 'text' 或 'image'
+        contact_key: 對象專屬密鑰（字串），用於解密
+        workers: 載體第一次計算時使用的程序數量（None 或 1 為單核心，0 為全部 CPU），結果與單核心相同
+    
+    返回:
+        secret: 還原的機密內容（字串或 PIL Image）
+        info: 額外資訊
+    
+    流程:
+        1. 圖片預處理（彩色轉灰階、檢查尺寸），取得載體索引
+        2. 一次還原所有機密位元（使用 contact_key 置換 Q）
+        3. 跳過類型標記，將機密位元轉回原始內容
+    """
+    # ========== 步驟 1：圖片預處理 ==========
+    index = get_cover_index(cover_image, workers=workers)
+    
+    # ========== 步驟 2：一次對所有需要的 8×8 區塊進行提取 ==========
+    secret_bits = index.extract_bits(z_bits, contact_key=contact_key)
+    
+    # ========== 步驟 3：將機密位元轉回原始內容 ==========
+    if len(secret_bits) < 1:
+        raise ValueError("提取的位元數不足，無法讀取類型標記")
+    
+    return _decode_content(secret_bits, secret_type)
+
+
+def detect_and_extract(cover_image, z_bits, contact_key=None, workers=None):
     """
     功能:
         自動偵測機密類型並提取
     
     參數:
-        cover_image: 無載體圖片
-        z_bits: Z 碼
+        cover_image: 無載體圖片，或已建立的 CoverIndex
+        z_bits: Z 碼（位元列表或 BitBuffer）
         contact_key: 對象專屬密鑰（字串），用於解密
+        workers: 載體第一次計算時使用的程序數量（None 或 1 為單核心，0 為全部 CPU），結果與單核心相同
     
     返回:
         secret: 機密內容
@@ -145,84 +105,286 @@ def detect_and_extract(cover_image, z_bits, contact_key=None):
         info: 額外資訊
     
     原理:
-        讀取第 1 bit 類型標記來決定解碼方式
+        先只用第一個區塊讀取第 1 bit 類型標記來決定解碼方式，再一次還原全部位元
         類型標記: 0 = 文字, 1 = 圖片
     """
-    # 先提取所有 bits
-    cover_image = np.array(cover_image)
-    
-    if len(cover_image.shape) == 3:
-        cover_image = (
-            0.299 * cover_image[:, :, 0] + 
-            0.587 * cover_image[:, :, 1] + 
-            0.114 * cover_image[:, :, 2]
-        ).astype(np.uint8)
-    
-    height, width = cover_image.shape
-    num_rows = height // BLOCK_SIZE
-    num_cols = width // BLOCK_SIZE
-    
-    secret_bits = []
-    z_bit_index = 0
-    finished = False
-    
-    for i in range(num_rows):
-        if finished:
-            break
-        for j in range(num_cols):
-            if z_bit_index >= len(z_bits):
-                finished = True
-                break
-            
-            block = cover_image[i*BLOCK_SIZE:(i+1)*BLOCK_SIZE, j*BLOCK_SIZE:(j+1)*BLOCK_SIZE]
-            # 使用 contact_key 生成 Q
-            Q = generate_Q_from_block(block, Q_LENGTH, contact_key=contact_key)
-            averages_21 = calculate_hierarchical_averages(block)
-            reordered = apply_Q_three_rounds(averages_21, Q)
-            msbs = get_msbs(reordered)
-            
-            for k in range(TOTAL_AVERAGES_PER_UNIT):
-                if z_bit_index >= len(z_bits):
-                    finished = True
-                    break
-                secret_bits.append(map_from_z(z_bits[z_bit_index], msbs[k]))
-                z_bit_index += 1
+    index = get_cover_index(cover_image, strict=False, workers=workers)
     
     # 檢查是否有足夠的 bits
-    if len(secret_bits) < 1:
+    if len(z_bits) < 1 or index.num_units == 0:
         raise ValueError("Z 碼太短，無法提取類型標記")
     
     # ========== 讀取類型標記（第 1 bit）==========
-    type_marker = secret_bits[0]
-    content_bits = secret_bits[1:]  # 跳過類型標記
+    type_marker = index.read_type_marker(z_bits, contact_key=contact_key)
+    secret_type = 'text' if type_marker == 0 else 'image'
     
-    if type_marker == 0:
-        # 文字類型
-        try:
-            text = binary_to_text(content_bits)
-            return text, 'text', {
-                'type': 'text', 
-                'length': len(text),
-                'type_marker': type_marker,
-                'total_bits': len(secret_bits),
-                'content_bits': len(content_bits)
-            }
-        except Exception as e:
+    secret_bits = index.extract_bits(z_bits, contact_key=contact_key)
+    
+    try:
+        secret, info = _decode_content(secret_bits, secret_type)
+    except Exception as e:
+        if secret_type == 'text':
             raise ValueError(f"文字解碼失敗: {e}")
+        raise ValueError(f"圖片解碼失敗: {e}")
+    
+    if secret is None:
+        raise ValueError("圖片解碼失敗: 圖片解碼返回 None")
+    
+    return secret, secret_type, info
+
+
+def extract_stream(cover_image, source, z_length=None, contact_key=None, as_text=False, workers=None):
+    """
+    功能:
+        串流提取：逐段讀入打包的 Z 碼，與載體區塊列同步前進，
+        每處理完一列 8×8 區塊就產生已還原的機密內容（記憶體只保留一列區塊的資料）
+
+    參數:
+        cover_image: 載體圖片，或已建立的 CoverIndex
+        source: 打包的 Z 碼（bytes、檔案類物件、bytes 片段的可迭代物件），或位元列表 / BitBuffer
+        z_length: Z 碼位元數；省略時使用全部資料（最後補位不足 1 byte，會自動捨去）
+        contact_key: 對象專屬密鑰（字串）
+        as_text: True 時產生 UTF-8 文字片段（只在完整字元邊界切開），False 時產生 bytes
+        workers: 載體第一次計算時使用的程序數量
+
+    返回:
+        產生器，依序產生 bytes 或 str 片段
+
+    注意:
+        只支援文字類型（類型標記 0）的 Z 碼，例如 embed_stream 的輸出；
+        所有文字片段接起來與 extract_secret(..., secret_type='text') 的結果相同
+    """
+    if isinstance(source, (list, tuple, np.ndarray)):
+        source = BitBuffer.from_bits(source)
+    if isinstance(source, BitBuffer):
+        source, z_length = source.to_bytes(), len(source) if z_length is None else z_length
+
+    index = get_cover_index(cover_image, workers=workers)
+    limit = index.capacity if z_length is None else min(z_length, index.capacity)
+    row_bits = (index.width // BLOCK_SIZE) * TOTAL_AVERAGES_PER_UNIT
+
+    chunks = iter_byte_chunks(source, -(-row_bits // 8))
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore') if as_text else None
+    pending = np.zeros(0, dtype=np.uint8)  # 還沒處理的 Z 碼位元
+    carry = None  # 還湊不滿 1 byte 的秘密位元；None 代表還沒讀到類型標記
+    total_bits = 0
+    exhausted = False
+
+    while total_bits < limit:
+        # 補滿一列區塊需要的 Z 碼位元
+        need = min(row_bits, limit - total_bits)
+        while not exhausted and len(pending) < need:
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            elif chunk:
+                pending = np.concatenate([pending, np.unpackbits(np.frombuffer(chunk, dtype=np.uint8))])
+
+        z_bits, pending = pending[:need], pending[need:]
+        if len(z_bits) == 0:
+            break
+
+        start = total_bits // TOTAL_AVERAGES_PER_UNIT
+        stop = start + -(-len(z_bits) // TOTAL_AVERAGES_PER_UNIT)
+        msbs = index.block_msbs(contact_key, start, stop).reshape(-1)[:len(z_bits)]
+        secret_bits = map_from_z_array(z_bits, msbs)
+        total_bits += len(z_bits)
+
+        if carry is None:
+            if secret_bits[0] != 0:
+                raise ValueError("串流提取只支援文字類型的 Z 碼（類型標記不是 0）")
+            carry, secret_bits = secret_bits[:0], secret_bits[1:]  # ← 跳過類型標記！
+
+        secret_bits = np.concatenate([carry, secret_bits])
+        aligned = len(secret_bits) - len(secret_bits) % 8
+        carry = secret_bits[aligned:]
+
+        if aligned:
+            data = np.packbits(secret_bits[:aligned]).tobytes()
+            if decoder is None:
+                yield data
+            else:
+                text = decoder.decode(data)
+                if text:
+                    yield text
+
+    if decoder is not None:
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+
+def _block_row_index(pixels, width, row_start, row_stop):
+    """
+    功能:
+        只讀取第 row_start 到 row_stop 個區塊列並建立這一段的索引（區塊編號從這段的第一個區塊起算）
+    """
+    gray = to_grayscale(read_pixel_rows(pixels, row_start * BLOCK_SIZE, row_stop * BLOCK_SIZE, width))
+    return CoverIndex(gray.shape[0], width, *compute_block_msbs(gray))
+
+
+def extract_range(cover_image, z_bits, start_byte, length, contact_key=None):
+    """
+    功能:
+        只提取機密內容中第 start_byte 起、長度 length 的 bytes（預覽、讀取 header、續傳用）
+
+    參數:
+        cover_image: 載體圖片（numpy array / PIL Image / 圖片檔路徑，見 tiled_cover.open_cover_pixels），
+                     或已建立的 CoverIndex
+        z_bits: Z 碼（位元列表或 BitBuffer）
+        start_byte: 起始 byte（不含類型標記，從 0 起算）
+        length: 要讀取的 bytes 數
+        contact_key: 對象專屬密鑰（字串）
+
+    返回:
+        data: 還原的 bytes；超出 Z 碼長度的部分不返回（可能比 length 短）
+        secret_type: 'text' 或 'image'（由第 1 bit 類型標記決定）
+
+    原理:
+        第 i 個區塊固定負責秘密位元 [21i, 21i+21)，
+        內容第 b 個 byte 位於秘密位元 [1+8b, 9+8b)（第 0 bit 是類型標記），
+        所以只需要涵蓋這段位元的連續區塊，加上第一個區塊的類型標記
+
+    注意:
+        傳入載體圖片時只對第一個區塊列與涵蓋這段位元的區塊列做灰階與 MSB/Q 計算，
+        不建立整張載體的索引（也不計算內容雜湊）；同一張載體要讀很多段時，
+        先用 get_cover_index 建立索引再傳入會更快
+    """
+    if start_byte < 0 or length < 0:
+        raise ValueError(f"範圍不可為負數: start_byte={start_byte}, length={length}")
+
+    if isinstance(cover_image, CoverIndex):
+        pixels, index = None, cover_image
+        num_cols, num_units = index.width // BLOCK_SIZE, index.num_units
     else:
-        # 圖片類型
+        pixels = open_cover_pixels(cover_image)
+        height, width = cover_dimensions(pixels)
+        num_cols = width // BLOCK_SIZE
+        num_units = (height // BLOCK_SIZE) * num_cols
+
+    if len(z_bits) < 1 or num_units == 0:
+        raise ValueError("Z 碼太短，無法提取類型標記")
+
+    # 類型標記只需要第一個區塊（第一個區塊列）
+    head = index if pixels is None else _block_row_index(pixels, width, 0, 1)
+    type_marker = head.read_type_marker(z_bits, contact_key=contact_key)
+    secret_type = 'text' if type_marker == 0 else 'image'
+
+    # 秘密位元範圍（只取完整的 byte）
+    available = min(len(z_bits), num_units * TOTAL_AVERAGES_PER_UNIT)
+    bit_start = 1 + 8 * start_byte
+    bit_stop = min(bit_start + 8 * length, available)
+    bit_stop -= max(0, bit_stop - bit_start) % 8
+    if bit_stop <= bit_start:
+        return b'', secret_type
+
+    # 只計算涵蓋這段位元的區塊
+    block_start = bit_start // TOTAL_AVERAGES_PER_UNIT
+    block_stop = -(-bit_stop // TOTAL_AVERAGES_PER_UNIT)
+    offset = block_start * TOTAL_AVERAGES_PER_UNIT
+
+    if pixels is None:
+        msbs = index.block_msbs(contact_key, block_start, block_stop)
+    else:
+        # 載體圖片：只讀取涵蓋這些區塊的區塊列（只在第一列時直接沿用 head）
+        row_start, row_stop = block_start // num_cols, -(-block_stop // num_cols)
+        band = head if (row_start, row_stop) == (0, 1) else _block_row_index(pixels, width, row_start, row_stop)
+        first_unit = row_start * num_cols
+        msbs = band.block_msbs(contact_key, block_start - first_unit, block_stop - first_unit)
+
+    msbs = msbs.reshape(-1)[bit_start - offset:bit_stop - offset]
+    z_range = np.asarray(z_bits[bit_start:bit_stop], dtype=np.uint8)
+
+    data = np.packbits(map_from_z_array(z_range, msbs)).tobytes()
+
+    return data, secret_type
+
+
+def extract_many(cover_image, items, workers=None):
+    """
+    功能:
+        同一張載體一次提取多筆 Z 碼（載體只預處理一次）
+
+    參數:
+        cover_image: 載體圖片，或已建立的 CoverIndex
+        items: [(z_bits, secret_type, contact_key), ...]；secret_type 為 None 或省略時自動偵測，
+               contact_key 可省略
+        workers: 載體第一次計算時使用的程序數量
+
+    返回:
+        results: 與 items 順序相同的列表，每筆為
+                 成功: {'success': True, 'secret': 機密內容, 'secret_type': 類型, 'info': 額外資訊}
+                 失敗: {'success': False, 'error': 錯誤訊息}（不影響其他筆）
+    """
+    index = get_cover_index(cover_image, strict=False, workers=workers)
+
+    results = []
+    for item in items:
         try:
-            img, orig_size, is_color = binary_to_image(content_bits)
-            if img is not None:
-                return img, 'image', {
-                    'type': 'image', 
-                    'size': orig_size, 
-                    'is_color': is_color,
-                    'type_marker': type_marker,
-                    'total_bits': len(secret_bits),
-                    'content_bits': len(content_bits)
-                }
+            z_bits, secret_type, contact_key = (tuple(item) + (None, None))[:3]
+            if secret_type is None:
+                secret, secret_type, info = detect_and_extract(index, z_bits, contact_key)
             else:
-                raise ValueError("圖片解碼返回 None")
+                secret, info = extract_secret(index, z_bits, secret_type, contact_key)
+            results.append({'success': True, 'secret': secret, 'secret_type': secret_type, 'info': info})
         except Exception as e:
-            raise ValueError(f"圖片解碼失敗: {e}")
+            results.append({'success': False, 'error': str(e)})
+
+    return results
+
+
+def extract_sharded(covers, z_codes, contact_key=None, workers=None):
+    """
+    功能:
+        從多張載體的分片 Z 碼（embed_sharded 的輸出）還原完整機密內容
+
+    參數:
+        covers: 載體圖片（或 CoverIndex）列表，與嵌入時傳給 embed_sharded 的相同
+        z_codes: Z 碼列表，第 i 個對應 covers[i]；可以比 covers 少（內容較小時只用到前面幾張載體，
+                 多出的載體不會被讀取）
+        contact_key: 對象專屬密鑰（字串）
+        workers: 同時處理的載體數（執行緒；None 或 1 為依序處理，0 為全部 CPU）
+
+    返回:
+        secret: 機密內容
+        secret_type: 'text' 或 'image'
+        info: 額外資訊（另含 'shards': 分片數量）
+    """
+    if len(z_codes) > len(covers):
+        raise ValueError(f"Z 碼數量 ({len(z_codes)}) 多於載體數量 ({len(covers)})")
+    if not z_codes:
+        raise ValueError("沒有任何分片")
+
+    def extract_shard(item):
+        cover_image, z_bits = item
+        bits = get_cover_index(cover_image).extract_bits(z_bits, contact_key=contact_key)
+        if len(bits) < SHARD_HEADER_BITS:
+            raise ValueError("Z 碼太短，無法讀取分片 header")
+
+        header = np.packbits(bits[:SHARD_HEADER_BITS]).tobytes()
+        shard_num, num_shards, payload_length = struct.unpack(SHARD_HEADER_FORMAT, header)
+        payload = bits[SHARD_HEADER_BITS:SHARD_HEADER_BITS + payload_length]
+        if len(payload) < payload_length:
+            raise ValueError(f"分片 {shard_num} 不完整（需要 {payload_length} bits，只有 {len(payload)} bits）")
+
+        return shard_num, num_shards, payload
+
+    shards = thread_map(extract_shard, zip(covers[:len(z_codes)], z_codes), workers)
+
+    # 檢查分片是否齊全（密鑰錯誤時 header 會是亂碼，也會在這裡被擋下）
+    num_shards = shards[0][1]
+    shard_nums = sorted(shard_num for shard_num, _, _ in shards)
+    if any(count != num_shards for _, count, _ in shards) or shard_nums != list(range(num_shards)):
+        raise ValueError(f"分片不完整或不一致（需要 {num_shards} 片，收到編號 {shard_nums}）")
+
+    secret_bits = np.concatenate([payload for _, _, payload in sorted(shards, key=lambda shard: shard[0])])
+    if len(secret_bits) < 1:
+        raise ValueError("提取的位元數不足，無法讀取類型標記")
+
+    secret_type = 'text' if secret_bits[0] == 0 else 'image'
+    secret, info = _decode_content(secret_bits, secret_type)
+    if secret is None:
+        raise ValueError("圖片解碼失敗: 圖片解碼返回 None")
+    info['shards'] = num_shards
+
+    return secret, secret_type, info
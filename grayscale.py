@@ -0,0 +1,103 @@
+# grayscale.py → 灰階轉換模組
+# 全專案共用的 RGB → 灰階轉換，所有模組都透過這裡轉換，確保同一張載體得到相同的灰階值
+
+import numpy as np
+
+# 灰階權重（ITU-R BT.601）
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+# PIL convert('L') 使用的定點權重（總和 65536），結果四捨五入
+PIL_GRAY_WEIGHTS = (19595, 38470, 7471)
+
+# 每次處理的列數：一段的浮點暫存約數百 KB，可留在 CPU 快取中
+GRAY_BAND_ROWS = 64
+
+def luminance(image):
+    """
+    功能:
+        計算彩色圖片未取整的亮度 0.299*R + 0.587*G + 0.114*B
+
+    參數:
+        image: numpy array，最後一維為色彩通道 (..., 3) 或 (..., 4)，只使用前 3 個通道
+
+    返回:
+        lum: float64 陣列，形狀為 image.shape[:-1]
+
+    原理:
+        與直接寫 0.299 * R + 0.587 * G + 0.114 * B 的運算與相加順序完全相同，結果逐位元一致；
+        差別只在於按列分段、重複使用暫存陣列，避免一次配置三張整圖大小的 float64 平面
+    """
+    image = np.asarray(image)
+    w_r, w_g, w_b = GRAY_WEIGHTS
+
+    lum = np.empty(image.shape[:-1], dtype=np.float64)
+    if lum.ndim == 0:
+        lum[...] = w_r * image[0] + w_g * image[1] + w_b * image[2]
+        return lum
+
+    for start in range(0, lum.shape[0], GRAY_BAND_ROWS):
+        band = image[start:start + GRAY_BAND_ROWS]
+        out = lum[start:start + GRAY_BAND_ROWS]
+        np.multiply(band[..., 0], w_r, out=out)
+        temp = np.multiply(band[..., 1], w_g)
+        out += temp
+        np.multiply(band[..., 2], w_b, out=temp)
+        out += temp
+
+    return lum
+
+
+def to_grayscale(image):
+    """
+    功能:
+        將圖片轉為灰階（小數直接捨去），灰階圖片原樣返回
+
+    參數:
+        image: numpy array，灰階 (H×W) 或彩色 (H×W×3 / H×W×4)
+
+    返回:
+        gray: 灰階圖片 (H×W)；彩色輸入時為 uint8
+    """
+    image = np.asarray(image)
+    if image.ndim != 3:
+        return image
+
+    gray = np.empty(image.shape[:2], dtype=np.uint8)
+    for start in range(0, image.shape[0], GRAY_BAND_ROWS):
+        # 與 .astype(np.uint8) 相同的轉型
+        gray[start:start + GRAY_BAND_ROWS] = luminance(image[start:start + GRAY_BAND_ROWS])
+
+    return gray
+
+
+def to_grayscale_pil(image):
+    """
+    功能:
+        與 PIL convert('L') 逐像素相同的灰階轉換（定點運算、四捨五入）
+
+    參數:
+        image: PIL Image 或 numpy array (H×W×3 / H×W×4，uint8)
+
+    返回:
+        gray: PIL Image 輸入時返回 L 模式 PIL Image；numpy 輸入時返回 uint8 陣列
+
+    注意:
+        介面從圖片庫下載的載體一直是用 PIL convert('L') 轉灰階，
+        和 to_grayscale 的捨去結果約有一半像素差 1；
+        已發出的 Z 碼依賴原本的灰階值，所以載體這條路徑必須維持 PIL 的算法
+    """
+    if hasattr(image, 'convert'):
+        return image if image.mode == 'L' else image.convert('L')
+
+    image = np.asarray(image)
+    if image.ndim != 3:
+        return image
+
+    w_r, w_g, w_b = PIL_GRAY_WEIGHTS
+    gray = np.empty(image.shape[:2], dtype=np.uint8)
+    for start in range(0, image.shape[0], GRAY_BAND_ROWS):
+        band = image[start:start + GRAY_BAND_ROWS].astype(np.uint32)
+        total = band[..., 0] * w_r + band[..., 1] * w_g + band[..., 2] * w_b + 0x8000
+        gray[start:start + GRAY_BAND_ROWS] = total >> 16
+
+    return gray
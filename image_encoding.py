@@ -3,55 +3,310 @@
 
 import numpy as np
 import math
+import struct
+import zlib
+from io import BytesIO
 
 from PIL import Image
-from binary_operations import int_to_binary, binary_to_int
+from bit_buffer import BitBuffer
+from grayscale import to_grayscale_pil
 
-def z_to_image(z_bits):
+# Z碼圖 header: Z碼長度 32 bits + 風格編號 8 bits + 圖像編號 16 bits + 尺寸 16 bits = 72 bits (9 bytes)
+Z_IMAGE_HEADER_FORMAT = '>IBHH'
+Z_IMAGE_HEADER_BYTES = struct.calcsize(Z_IMAGE_HEADER_FORMAT)
+
+# Z碼圖 v2 header: 識別碼 4 bytes + 版本 8 bits + Z碼長度 32 bits + 風格編號 8 bits
+#                  + 圖像編號 16 bits + 尺寸 16 bits + CRC32 32 bits = 18 bytes
+# 像素為 RGB（每像素 24 bits）或 RGBA（每像素 32 bits），CRC32 涵蓋 CRC 之前的 header 與 Z 碼
+Z_IMAGE_V2_MAGIC = b'ZIMG'
+Z_IMAGE_V2_HEADER_FORMAT = '>4sBIBHHI'
+Z_IMAGE_V2_HEADER_BYTES = struct.calcsize(Z_IMAGE_V2_HEADER_FORMAT)
+Z_IMAGE_VERSION = 2
+
+# 每像素的 bytes 數
+Z_IMAGE_MODE_BYTES = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+# 讀取 header 所需的像素資料 bytes 數（v2 header，或 RGBA 存放的舊版 9 個灰階像素）
+Z_IMAGE_PEEK_BYTES = max(Z_IMAGE_V2_HEADER_BYTES, Z_IMAGE_HEADER_BYTES * 4)
+
+# PNG 檔頭與可以只解開前幾列的色彩格式（8 bits、非交錯）
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COLOR_MODES = {0: 'L', 2: 'RGB', 6: 'RGBA'}
+
+# Z 碼幾乎是隨機資料，PNG 高壓縮等級只會更慢、不會更小
+Z_IMAGE_PNG_OPTIONS = {'compress_level': 1}
+
+def _bytes_to_square_image(data, mode='L'):
   """
   功能:
-    將 Z 碼位元列表編碼成灰階圖片
+    將 bytes 依序填入接近正方形的圖片（L / RGB / RGBA），不足的像素補 0
   """
-  num_bits = len(z_bits)
-  num_pixels = math.ceil(num_bits / 8)
+  channels = Z_IMAGE_MODE_BYTES[mode]
+  num_pixels = math.ceil(len(data) / channels)
 
-  if num_bits % 8 != 0:
-    padding = 8 - (num_bits % 8)
-    z_bits = z_bits + [0] * padding
-  
-  pixels = []
-  for i in range(0, len(z_bits), 8):
-    byte = z_bits[i:i+8]
-    pixel_value = binary_to_int(byte)
-    pixels.append(pixel_value)
-  
   width = int(math.sqrt(num_pixels))
   height = math.ceil(num_pixels / width)
-  
-  while len(pixels) < width * height:
-    pixels.append(0)
-  
-  pixel_array = np.array(pixels, dtype=np.uint8)
-  pixel_array = pixel_array[:width * height].reshape(height, width)
-  
-  image = Image.fromarray(pixel_array, mode='L')
-  
+
+  # 補 0 到整張圖的大小，frombuffer 直接使用這塊記憶體，不再逐像素複製
+  padded = bytes(data) + bytes(width * height * channels - len(data))
+  image = Image.frombuffer(mode, (width, height), padded, 'raw', mode, 0, 1)
+
+  return image
+
+def z_image_to_png(image):
+  """
+  功能:
+    將 Z碼圖存成 PNG bytes（使用快速的壓縮設定）
+  """
+  buf = BytesIO()
+  image.save(buf, format='PNG', **Z_IMAGE_PNG_OPTIONS)
+  return buf.getvalue()
+
+def z_to_image(z_bits):
+  """
+  功能:
+    將 Z 碼位元列表（或 BitBuffer）編碼成灰階圖片
+  """
+  z_buffer = BitBuffer.from_bits(z_bits)
+
+  # 每 8 bits 一個像素，最後不足 8 bits 補 0
+  image = _bytes_to_square_image(z_buffer.to_bytes())
+
   return image
 
-def image_to_z(image, original_bit_length=None):
+def image_to_z(image, original_bit_length=None, packed=False):
   """
   功能:
-    從灰階圖片解碼 Z 碼位元列表
+    從灰階圖片解碼 Z 碼位元列表（packed=True 時返回 BitBuffer）
   """
   pixel_array = np.array(image)
-  pixels = pixel_array.flatten()
-  
-  z_bits = []
-  for pixel in pixels:
-    binary = int_to_binary(pixel, 8)
-    z_bits.extend(binary)
-  
+  pixels = pixel_array.astype(np.uint8).flatten()
+
+  num_bits = len(pixels) * 8
   if original_bit_length is not None:
-    z_bits = z_bits[:original_bit_length]
-  
-  return z_bits
+    num_bits = min(num_bits, original_bit_length)
+
+  z_bits = BitBuffer.from_bytes(pixels.tobytes(), num_bits)
+
+  return z_bits if packed else z_bits.tolist()
+
+def encode_z_as_image_with_header(z_bits, style_num, img_num, img_size, version=Z_IMAGE_VERSION, mode='RGB'):
+  """
+  功能:
+    Z碼圖編碼（含風格編號、圖像編號和尺寸）
+
+  參數:
+    z_bits: Z 碼（位元列表或 BitBuffer）
+    style_num: 風格編號 (8 bits)
+    img_num: 圖像編號 (16 bits)
+    img_size: 載體圖像尺寸 (16 bits)
+    version: 2 為 RGB/RGBA 含 CRC32 的格式；1 為舊版灰階格式
+    mode: v2 的像素格式 'RGB' 或 'RGBA'
+
+  返回:
+    image: Z碼圖
+    length: Z 碼位元數
+  """
+  z_buffer = BitBuffer.from_bits(z_bits)
+  length = len(z_buffer)
+
+  if version == 1:
+    # header 剛好 9 bytes，後面直接接上打包好的 Z 碼
+    header = struct.pack(Z_IMAGE_HEADER_FORMAT, length, style_num, img_num, img_size)
+    return _bytes_to_square_image(header + z_buffer.to_bytes()), length
+
+  if version != Z_IMAGE_VERSION or mode not in ('RGB', 'RGBA'):
+    raise ValueError(f"不支援的 Z碼圖格式：版本 {version}，{mode}")
+
+  payload = z_buffer.to_bytes()
+  fields = (Z_IMAGE_V2_MAGIC, version, length, style_num, img_num, img_size)
+  crc = zlib.crc32(payload, zlib.crc32(struct.pack(Z_IMAGE_V2_HEADER_FORMAT[:-1], *fields)))
+  header = struct.pack(Z_IMAGE_V2_HEADER_FORMAT, *fields, crc)
+  image = _bytes_to_square_image(header + payload, mode)
+
+  return image, length
+
+def read_png_prefix(data, num_bytes):
+  """
+  功能:
+    只解壓縮 PNG 的前幾列，取得最前面 num_bytes 個像素資料 bytes
+
+  參數:
+    data: PNG 檔案 bytes
+    num_bytes: 需要的 bytes 數（超過整張圖時取整張圖）
+
+  返回:
+    (mode, width, height, prefix)；不是 PNG 或格式不支援（非 8 bits、交錯、調色盤等）時返回 None
+
+  原理:
+    PNG 每列前面有一個濾波類型 byte，濾波只參考左邊與上一列同位置的 bytes，
+    所以每列只需還原前 k 個 bytes；zlib 也只解壓縮到需要的列數為止
+  """
+  if data[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+    return None
+
+  decompressor = zlib.decompressobj()
+  raw = b''
+  mode = None
+  pos = len(PNG_SIGNATURE)
+
+  while pos + 8 <= len(data):
+    length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+    body = data[pos + 8:pos + 8 + length]
+    pos += length + 12
+
+    if chunk_type == b'IHDR':
+      width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', body)
+      if depth != 8 or interlace or color not in PNG_COLOR_MODES:
+        return None
+      mode = PNG_COLOR_MODES[color]
+      bpp = Z_IMAGE_MODE_BYTES[mode]
+      row_bytes = width * bpp
+      num_bytes = min(num_bytes, row_bytes * height)
+      rows = max(1, math.ceil(num_bytes / row_bytes))
+      keep = min(row_bytes, num_bytes)
+      needed = rows * (row_bytes + 1) - (row_bytes - keep)
+    elif chunk_type == b'IDAT' and mode is not None:
+      raw += decompressor.decompress(decompressor.unconsumed_tail + body, needed - len(raw))
+      if len(raw) >= needed:
+        break
+    elif chunk_type == b'IEND':
+      break
+
+  if mode is None or len(raw) < needed:
+    return None
+
+  prefix = bytearray()
+  prev = bytearray(keep)
+  for r in range(rows):
+    line = raw[r * (row_bytes + 1):r * (row_bytes + 1) + keep + 1]
+    filter_type, cur = line[0], bytearray(line[1:])
+    for x in range(keep):
+      a = cur[x - bpp] if x >= bpp else 0
+      b = prev[x]
+      c = prev[x - bpp] if x >= bpp else 0
+      if filter_type == 1:
+        cur[x] = (cur[x] + a) & 0xFF
+      elif filter_type == 2:
+        cur[x] = (cur[x] + b) & 0xFF
+      elif filter_type == 3:
+        cur[x] = (cur[x] + (a + b) // 2) & 0xFF
+      elif filter_type == 4:
+        p = a + b - c
+        pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+        cur[x] = (cur[x] + (a if pa <= pb and pa <= pc else b if pb <= pc else c)) & 0xFF
+      elif filter_type != 0:
+        return None
+    prefix += cur
+    prev = cur
+
+  return mode, width, height, bytes(prefix[:num_bytes])
+
+def _parse_z_header(prefix, mode, num_pixels):
+  """
+  功能:
+    從像素資料的開頭解析 Z碼圖 header（v2 或舊版灰階格式）
+
+  參數:
+    prefix: 像素資料的開頭（至少 Z_IMAGE_PEEK_BYTES 或整張圖）
+    mode: 'L'、'RGB' 或 'RGBA'
+    num_pixels: 整張圖的像素數（用來檢查 Z 碼長度）
+
+  返回:
+    version, z_length, style_num, img_num, img_size, crc（舊版為 None）
+  """
+  channels = Z_IMAGE_MODE_BYTES[mode]
+
+  if mode != 'L' and prefix[:len(Z_IMAGE_V2_MAGIC)] == Z_IMAGE_V2_MAGIC:
+    if len(prefix) < Z_IMAGE_V2_HEADER_BYTES:
+      raise ValueError("Z碼圖格式錯誤：太小")
+
+    _, version, z_length, style_num, img_num, img_size, crc = struct.unpack(
+      Z_IMAGE_V2_HEADER_FORMAT, prefix[:Z_IMAGE_V2_HEADER_BYTES])
+
+    if version != Z_IMAGE_VERSION:
+      raise ValueError(f"不支援的 Z碼圖版本：{version}")
+    if z_length <= 0 or (z_length + 7) // 8 > num_pixels * channels - Z_IMAGE_V2_HEADER_BYTES:
+      raise ValueError(f"無效的 Z碼（長度：{z_length}）")
+
+    return version, z_length, style_num, img_num, img_size, crc
+
+  # 舊版灰階格式（被轉存成彩色的舊版 Z碼圖 R=G=B，轉回灰階後不變）
+  if mode != 'L':
+    pixels = np.frombuffer(prefix, dtype=np.uint8)[:len(prefix) // channels * channels]
+    prefix = to_grayscale_pil(pixels.reshape(1, -1, channels)).tobytes()
+
+  if len(prefix) < Z_IMAGE_HEADER_BYTES:  # 32 + 8 + 16 + 16 = 72 bits
+    raise ValueError("Z碼圖格式錯誤：太小")
+
+  z_length, style_num, img_num, img_size = struct.unpack(Z_IMAGE_HEADER_FORMAT, prefix[:Z_IMAGE_HEADER_BYTES])
+
+  if z_length <= 0 or z_length > (num_pixels - Z_IMAGE_HEADER_BYTES) * 8:
+    raise ValueError(f"無效的 Z碼（長度：{z_length}）")
+
+  return 1, z_length, style_num, img_num, img_size, None
+
+def peek_z_image_header(source):
+  """
+  功能:
+    只讀取 Z碼圖的 header（風格編號、圖像編號、尺寸與 Z 碼長度），不解碼 Z 碼
+
+  參數:
+    source: PNG 檔案 bytes，或 PIL Image
+
+  返回:
+    version: Z碼圖版本（1 或 2）
+    z_length: Z 碼位元數
+    style_num, img_num, img_size: 風格編號、圖像編號、載體圖像尺寸
+
+  說明:
+    PNG bytes 只解壓縮前幾列（見 read_png_prefix）；其他格式或 PIL Image 才解碼整張圖，
+    但仍只解析 header，不建立 Z 碼；v2 的 CRC 要在完整解碼時才能檢查
+  """
+  if isinstance(source, Image.Image):
+    image = source
+  else:
+    png = read_png_prefix(source, Z_IMAGE_PEEK_BYTES)
+    if png is not None:
+      mode, width, height, prefix = png
+      return _parse_z_header(prefix, mode, width * height)[:5]
+    image = Image.open(BytesIO(source))
+
+  if image.mode not in Z_IMAGE_MODE_BYTES:
+    image = image.convert('L')
+
+  prefix = image.tobytes()[:Z_IMAGE_PEEK_BYTES]
+  return _parse_z_header(prefix, image.mode, image.size[0] * image.size[1])[:5]
+
+def decode_image_to_z_with_header(image, packed=False):
+  """
+  功能:
+    Z碼圖解碼（含風格編號、圖像編號和尺寸），自動辨識 v2 與舊版灰階格式
+
+  參數:
+    image: Z碼圖 (PIL Image)
+    packed: True 時 Z 碼以 BitBuffer 返回
+
+  返回:
+    z_bits: Z 碼（位元列表或 BitBuffer）
+    style_num, img_num, img_size: 風格編號、圖像編號、載體圖像尺寸
+  """
+  if image.mode not in Z_IMAGE_MODE_BYTES:
+    image = image.convert('L')
+
+  data = image.tobytes()
+  version, z_length, style_num, img_num, img_size, crc = _parse_z_header(
+    data[:Z_IMAGE_PEEK_BYTES], image.mode, image.size[0] * image.size[1])
+
+  if version == Z_IMAGE_VERSION:
+    payload = data[Z_IMAGE_V2_HEADER_BYTES:Z_IMAGE_V2_HEADER_BYTES + (z_length + 7) // 8]
+    if zlib.crc32(payload, zlib.crc32(data[:Z_IMAGE_V2_HEADER_BYTES - 4])) != crc:
+      raise ValueError("Z碼圖 CRC 檢查失敗：檔案可能已損壞或被壓縮過")
+  else:
+    if image.mode != 'L':
+      data = image.convert('L').tobytes()
+    payload = data[Z_IMAGE_HEADER_BYTES:]
+
+  z_bits = BitBuffer.from_bytes(payload, z_length)
+
+  return (z_bits if packed else z_bits.tolist()), style_num, img_num, img_size
@@ -0,0 +1,94 @@
+# image_library.py → 圖片庫載體下載模組
+# 介面與索引預建工具共用，確保兩邊得到的灰階載體完全相同
+
+from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+import requests
+from PIL import Image
+
+from config import IMAGE_LIBRARY
+from grayscale import to_grayscale_pil
+
+# 背景預先下載：最多同時下載的張數與保留的下載結果數
+PREFETCH_WORKERS = 2
+PREFETCH_KEEP = 8
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+_prefetch_futures = OrderedDict()
+_prefetch_lock = threading.Lock()
+
+def library_image_url(pexels_id, size):
+    """
+    功能:
+        取得圖片庫圖片指定尺寸的下載網址
+    """
+    return f"https://images.pexels.com/photos/{pexels_id}/pexels-photo-{pexels_id}.jpeg?auto=compress&cs=tinysrgb&w={size}&h={size}&fit=crop"
+
+def fetch_library_image(pexels_id, size):
+    """
+    功能:
+        下載圖片庫圖片的原始檔案內容
+
+    返回:
+        image_data: 圖片檔 bytes，下載失敗時返回 None
+    """
+    try:
+        response = requests.get(library_image_url(pexels_id, size), timeout=10)
+        if response.status_code == 200:
+            return response.content
+    except Exception:
+        pass
+    return None
+
+def prefetch_library_image(pexels_id, size):
+    """
+    功能:
+        在背景開始下載圖片庫圖片（同一張圖片只下載一次）
+
+    返回:
+        future: concurrent.futures.Future，result() 為 fetch_library_image 的結果
+
+    說明:
+        提取頁面讀到 Z碼圖 header 後就先開始下載載體，按下「開始提取」時通常已經下載完成；
+        下載失敗的結果不保留，下次會重新下載
+    """
+    key = (pexels_id, size)
+    with _prefetch_lock:
+        future = _prefetch_futures.get(key)
+        if future is None or (future.done() and future.result() is None):
+            future = _prefetch_executor.submit(fetch_library_image, pexels_id, size)
+        _prefetch_futures[key] = future
+        _prefetch_futures.move_to_end(key)
+        while len(_prefetch_futures) > PREFETCH_KEEP:
+            _prefetch_futures.popitem(last=False)
+    return future
+
+def decode_library_image(image_data, size):
+    """
+    功能:
+        將下載的圖片檔解碼成 size×size 的彩色圖與灰階載體
+
+    返回:
+        img: RGB 圖片
+        img_gray: 灰階載體 (L 模式)
+    """
+    img = Image.open(BytesIO(image_data)).convert('RGB')
+    if img.size[0] != size or img.size[1] != size:
+        img = img.resize((size, size), Image.LANCZOS)
+    img_gray = to_grayscale_pil(img)
+    return img, img_gray
+
+def iter_library_images():
+    """
+    功能:
+        依序列出圖片庫所有圖片
+
+    返回:
+        (風格名稱, 圖像編號 (1-based), 圖片資料) 的迭代器
+    """
+    for style_name, images in IMAGE_LIBRARY.items():
+        for img_num, entry in enumerate(images, start=1):
+            yield style_name, img_num, entry
@@ -1,8 +1,9 @@
-
 # 建立 image_processing.py → 圖片處理模組
 
 import numpy as np
 
+from grayscale import to_grayscale
+
 def calculate_hierarchical_averages(block_8x8):
   """
   功能:
@@ -21,26 +22,11 @@ def calculate_hierarchical_averages(block_8x8):
     第一層: 將 8×8 圖片切成 16 個 2×2 區塊，計算每個區塊平均值
     第二層: 將第一層的 16 個平均值排成 4×4，分成 4 組 (每組 2×2)，計算每組平均值
     第三層: 將第二層的 4 個平均值計算總平均
+    （與整張圖片共用 calculate_all_averages 的整數核心）
   """
-  block_8x8 = np.array(block_8x8)
-
-  # ========== 第一層: 16 個 2×2 區塊 (向量化) ==========
-  # 把 8×8 reshape 成 (4, 2, 4, 2)，對 axis 1 和 3 取平均
-  reshaped = block_8x8.reshape(4, 2, 4, 2)
-  layer1 = reshaped.mean(axis=(1, 3))  # 結果: 4×4
-  layer1_averages = layer1.flatten().astype(int).tolist()
+  block_8x8 = np.array(block_8x8).reshape(8, 8)
 
-  # ========== 第二層: 4 個分組 (對第一層的 16 個平均值重新分組) (向量化) ==========
-  # 把 4×4 reshape 成 (2, 2, 2, 2)，對 axis 1 和 3 取平均
-  layer1_2x2 = layer1.reshape(2, 2, 2, 2)
-  layer2 = layer1_2x2.mean(axis=(1, 3))  # 結果: 2×2
-  layer2_averages = layer2.flatten().astype(int).tolist()
-
-  # ========== 第三層: 1 個 8×8 整體 (對第二層的 4 個平均值計算總平均) ==========
-  layer3_average = int(layer2.mean())
-
-  # ========== 合併三層結果 ==========
-  averages_21 = layer1_averages + layer2_averages + [layer3_average]
+  averages_21 = calculate_all_averages(block_8x8)[0].tolist()
     
   return averages_21
 
@@ -53,8 +39,8 @@ def process_image_multilayer(image):
     image: numpy array，灰階圖片（H×W）或彩色圖片（H×W×3）
 
   返回:
-    all_averages: 所有 8×8 區塊的平均值列表
-                  結構: [[區塊1 的 21 個平均值], [區塊2 的 21 個平均值], ...]
+    all_averages: 所有 8×8 區塊的平均值陣列 (uint8)
+                  結構: (區塊數, 21)，第 i 列為第 i 個區塊的 21 個平均值
     num_units: 8×8 區塊的數量
   """
   image = np.array(image)
@@ -63,7 +49,7 @@ def process_image_multilayer(image):
   if len(image.shape) == 3:  # 彩色圖片
     # 使用標準灰階轉換公式
     # 綠色權重最高 (0.587)，紅色次之 (0.299)，藍色最低 (0.114)
-    image = (0.299 * image[:, :, 0] + 0.587 * image[:, :, 1] + 0.114 * image[:, :, 2]).astype(np.uint8)
+    image = to_grayscale(image)
 
   height, width = image.shape
 
@@ -71,36 +57,57 @@ def process_image_multilayer(image):
   if height % 8 != 0 or width % 8 != 0:
     raise ValueError(f"圖片大小必須是 8 的倍數！當前大小: {width}×{height}")
 
+  all_averages = calculate_all_averages(image)
+  num_units = all_averages.shape[0]
+
+  return all_averages, num_units
+
+def calculate_all_averages(image):
+  """
+  功能:
+    一次計算灰階圖片中所有 8×8 區塊的 21 個多層次平均值（整數核心）
+
+  參數:
+    image: numpy array，灰階圖片（H×W），H 與 W 皆為 8 的倍數，像素值 0-255
+
+  返回:
+    all_averages: (區塊數, 21) 的 uint8 陣列，區塊依列優先順序排列
+
+  原理:
+    像素非負，所以三層平均值取整後恰好是
+      第一層: floor(2×2 總和 / 4)   = sum4  >> 2
+      第二層: floor(4×4 總和 / 16)  = sum16 >> 4
+      第三層: floor(8×8 總和 / 64)  = sum64 >> 6
+    總和最大 64×255 = 16320，用 uint16 累加即可，不需要 float64 中間結果
+  """
+  image = np.asarray(image)
+  if image.dtype != np.uint8:
+    image = image.astype(np.uint8)
+
+  height, width = image.shape
+
   # 計算有多少個 8×8 區塊
   num_rows = height // 8
   num_cols = width // 8
   num_units = num_rows * num_cols
 
-  # ========== 向量化優化: 一次處理所有區塊 ==========
-  # 步驟 1: 把整張圖片 reshape 成所有 8×8 區塊
-  # (H, W) → (num_rows, 8, num_cols, 8) → (num_units, 8, 8)
-  blocks = image.reshape(num_rows, 8, num_cols, 8).transpose(0, 2, 1, 3).reshape(num_units, 8, 8)
-
-  # 步驟 2: 第一層 - 每個區塊的 16 個 2×2 平均值
-  # (num_units, 8, 8) → (num_units, 4, 2, 4, 2)
-  reshaped = blocks.reshape(num_units, 4, 2, 4, 2)
-  layer1 = reshaped.mean(axis=(2, 4))  # (num_units, 4, 4)
-  layer1_flat = layer1.reshape(num_units, 16)
+  # 步驟 1: 第一層 - 相鄰兩列相加，再相鄰兩行相加 → 每個 2×2 的總和
+  pair_rows = image[0::2].astype(np.uint16)
+  pair_rows += image[1::2]
+  sum4 = pair_rows[:, 0::2] + pair_rows[:, 1::2]  # (H/2, W/2)
 
-  # 步驟 3: 第二層 - 每個區塊的 4 個分組平均值
-  # (num_units, 4, 4) → (num_units, 2, 2, 2, 2)
-  layer1_2x2 = layer1.reshape(num_units, 2, 2, 2, 2)
-  layer2 = layer1_2x2.mean(axis=(2, 4))  # (num_units, 2, 2)
-  layer2_flat = layer2.reshape(num_units, 4)
+  # 步驟 2: 第二層 - 對 2×2 總和再做一次 → 每個 4×4 的總和
+  pair_rows = sum4[0::2] + sum4[1::2]
+  sum16 = pair_rows[:, 0::2] + pair_rows[:, 1::2]  # (H/4, W/4)
 
-  # 步驟 4: 第三層 - 每個區塊的 1 個總平均
-  layer3 = layer2.mean(axis=(1, 2)).reshape(num_units, 1)
+  # 步驟 3: 第三層 - 再做一次 → 每個 8×8 的總和
+  pair_rows = sum16[0::2] + sum16[1::2]
+  sum64 = pair_rows[:, 0::2] + pair_rows[:, 1::2]  # (H/8, W/8)
 
-  # 步驟 5: 合併三層，轉成整數
-  all_averages_array = np.concatenate([layer1_flat, layer2_flat, layer3], axis=1)
-  all_averages_array = all_averages_array.astype(int)
+  # 步驟 4: 右移取整，依區塊排成 (num_rows, num_cols, 21)
+  all_averages = np.empty((num_rows, num_cols, 21), dtype=np.uint8)
+  all_averages[:, :, :16] = (sum4 >> 2).reshape(num_rows, 4, num_cols, 4).transpose(0, 2, 1, 3).reshape(num_rows, num_cols, 16)
+  all_averages[:, :, 16:20] = (sum16 >> 4).reshape(num_rows, 2, num_cols, 2).transpose(0, 2, 1, 3).reshape(num_rows, num_cols, 4)
+  all_averages[:, :, 20] = sum64 >> 6
 
-  # 轉成列表格式（保持原有介面）
-  all_averages = all_averages_array.tolist()
-
-  return all_averages, num_units
+  return all_averages.reshape(num_units, 21)
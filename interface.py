@@ -7,7 +7,6 @@ import streamlit as st
 import streamlit.components.v1 as components
 import numpy as np
 from PIL import Image, ImageDraw
-import requests
 from io import BytesIO
 import os
 import math
@@ -16,17 +15,20 @@ import base64
 import json
 import qrcode
 import html
+import hashlib
 
-# 延遲載入 pyzbar（較慢的套件）
-@st.cache_resource
-def load_pyzbar():
-    from pyzbar.pyzbar import decode as decode_qr
-    return decode_qr
 
 from config import *
 from embed import embed_secret
 from extract import detect_and_extract
+from cover_index import get_cover_index
 from secret_encoding import text_to_binary, image_to_binary, binary_to_image
+from image_encoding import encode_z_as_image_with_header, decode_image_to_z_with_header, z_image_to_png, peek_z_image_header
+from text_encoding import z_to_compact_text, is_compact_z_text, text_to_z
+from image_library import prefetch_library_image, decode_library_image
+from grayscale import to_grayscale_pil
+from qr_transport import QR_MAX_PARTS, count_z_parts, split_z_payload, is_z_part, join_z_parts, parse_qr_header
+from qr_decode import decode_qr_texts
 
 # ==================== 生成高質量圖片函數 ====================
 def generate_gradient_image(size, color1, color2, direction='horizontal'):
@@ -171,56 +173,6 @@ STYLE_TO_NUM = {
 
 NUM_TO_STYLE = {1: "建築", 2: "動物", 3: "植物", 4: "食物", 5: "交通"}
 
-AVAILABLE_SIZES = [64, 128, 256, 512, 1024, 2048, 4096]
-
-IMAGE_LIBRARY = {
-    "建築": [
-        {"id": 29493117, "name": "哈里發塔"},
-        {"id": 34132869, "name": "比薩斜塔"},
-        {"id": 16457365, "name": "埃菲爾鐵塔"},
-        {"id": 236294, "name": "聖彼得大教堂"},
-        {"id": 16681013, "name": "謝赫扎耶德大清真寺"},
-        {"id": 29144355, "name": "熨斗大樓"},
-        {"id": 1650904, "name": "泰坦尼克博物館"},
-    ],
-    "動物": [
-        {"id": 1108099, "name": "拉布拉多"},
-        {"id": 568022, "name": "白羊"},
-        {"id": 19613749, "name": "兔子"},
-        {"id": 7060929, "name": "刺蝟"},
-        {"id": 19597261, "name": "松鼠"},
-        {"id": 10386190, "name": "梅花鹿"},
-        {"id": 34954771, "name": "栗頭蜂虎"},
-    ],
-    "植物": [
-        {"id": 1048024, "name": "仙人掌"},
-        {"id": 11259955, "name": "雛菊"},
-        {"id": 6830332, "name": "櫻花"},
-        {"id": 7048610, "name": "鬱金香"},
-        {"id": 18439973, "name": "洋牡丹"},
-        {"id": 244796, "name": "木槿花"},
-        {"id": 206837, "name": "勿忘我"},
-    ],
-    "食物": [
-        {"id": 28503601, "name": "海鮮燉飯"},
-        {"id": 32538755, "name": "紅醬義大利麵"},
-        {"id": 1566837, "name": "比薩"},
-        {"id": 7245468, "name": "壽司"},
-        {"id": 4110272, "name": "水果拼盤"},
-        {"id": 6441084, "name": "草莓蛋糕"},
-        {"id": 7144558, "name": "鬆餅"},
-    ],
-    "交通": [
-        {"id": 33435422, "name": "摩托車"},
-        {"id": 1595483, "name": "自行車"},
-        {"id": 2263673, "name": "巴士"},
-        {"id": 33519108, "name": "火車"},
-        {"id": 33017407, "name": "飛機"},
-        {"id": 843633, "name": "遊艇"},
-        {"id": 586040, "name": "火箭"},
-    ],
-}
-
 def get_recommended_size(secret_bits):
     """根據機密大小推薦最小適合尺寸"""
     for size in AVAILABLE_SIZES:
@@ -231,31 +183,34 @@ def get_recommended_size(secret_bits):
 
 @st.cache_data(ttl=86400, show_spinner=False)
 def download_image_cached(pexels_id, size):
-    """下載並快取圖片（持久化）"""
-    url = f"https://images.pexels.com/photos/{pexels_id}/pexels-photo-{pexels_id}.jpeg?auto=compress&cs=tinysrgb&w={size}&h={size}&fit=crop"
-    try:
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
-            return response.content
-    except:
-        pass
-    return None
+    """下載並快取圖片（持久化）；已在背景預先下載時直接取用結果"""
+    return prefetch_library_image(pexels_id, size).result()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def decode_upload_qr(upload_hash, _data):
+    """辨識上傳圖片中的 QR Code（以檔案內容的雜湊值快取，重新執行腳本時不再辨識）"""
+    return decode_qr_texts(Image.open(BytesIO(_data)))
 
 def download_image_by_id(pexels_id, size):
     """下載指定 ID 和尺寸的圖片"""
     image_data = download_image_cached(pexels_id, size)
     
     if image_data:
-        img = Image.open(BytesIO(image_data)).convert('RGB')
-        if img.size[0] != size or img.size[1] != size:
-            img = img.resize((size, size), Image.LANCZOS)
-        img_gray = img.convert('L')
-        return img, img_gray
+        return decode_library_image(image_data, size)
     
     img = generate_gradient_image(size, (100, 150, 200), (150, 200, 250))
-    return img, img.convert('L')
+    return img, to_grayscale_pil(img)
 
 # ==================== 輔助函數 ====================
+def make_qr_png(content):
+    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=2)
+    qr.add_data(content)
+    qr.make(fit=True)
+    qr_pil = qr.make_image(fill_color="black", back_color="white").convert('RGB')
+    buf = BytesIO()
+    qr_pil.save(buf, format='PNG')
+    return buf.getvalue()
+
 def calculate_image_capacity(size):
     return (size * size) // 64 * 21
 
@@ -296,65 +251,6 @@ def calculate_required_bits_for_image(image, target_capacity=None):
         scaled = (max(8, (int(original_size[0] * ratio) // 8) * 8), max(8, (int(original_size[1] * ratio) // 8) * 8))
     return header_bits + scaled[0] * scaled[1] * bits_per_pixel, scaled
 
-# ==================== Z碼圖編碼/解碼 ====================
-def encode_z_as_image_with_header(z_bits, style_num, img_num, img_size):
-    """Z碼圖編碼（含風格編號、圖像編號和尺寸）"""
-    length = len(z_bits)
-    header_bits = [int(b) for b in format(length, '032b')]
-    header_bits += [int(b) for b in format(style_num, '08b')]  # 風格編號 8 bits
-    header_bits += [int(b) for b in format(img_num, '016b')]
-    header_bits += [int(b) for b in format(img_size, '016b')]
-    full_bits = header_bits + z_bits
-    
-    if len(full_bits) % 8 != 0:
-        padding = 8 - (len(full_bits) % 8)
-        full_bits = full_bits + [0] * padding
-    
-    pixels = []
-    for i in range(0, len(full_bits), 8):
-        byte = full_bits[i:i+8]
-        pixel_value = int(''.join(map(str, byte)), 2)
-        pixels.append(pixel_value)
-    
-    num_pixels = len(pixels)
-    width = int(math.sqrt(num_pixels))
-    height = math.ceil(num_pixels / width)
-    
-    while len(pixels) < width * height:
-        pixels.append(0)
-    
-    image = Image.new('L', (width, height))
-    image.putdata(pixels[:width * height])
-    
-    return image, length
-
-def decode_image_to_z_with_header(image):
-    """Z碼圖解碼（含風格編號、圖像編號和尺寸）"""
-    if image.mode != 'L':
-        image = image.convert('L')
-    
-    pixels = list(image.getdata())
-    
-    all_bits = []
-    for pixel in pixels:
-        bits = [int(b) for b in format(pixel, '08b')]
-        all_bits.extend(bits)
-    
-    if len(all_bits) < 72:  # 32 + 8 + 16 + 16 = 72
-        raise ValueError("Z碼圖格式錯誤：太小")
-    
-    z_length = int(''.join(map(str, all_bits[:32])), 2)
-    style_num = int(''.join(map(str, all_bits[32:40])), 2)
-    img_num = int(''.join(map(str, all_bits[40:56])), 2)
-    img_size = int(''.join(map(str, all_bits[56:72])), 2)
-    
-    if z_length <= 0 or z_length > len(all_bits) - 72:
-        raise ValueError(f"無效的 Z碼（長度：{z_length}）")
-    
-    z_bits = all_bits[72:72 + z_length]
-    
-    return z_bits, style_num, img_num, img_size
-
 # ==================== Streamlit 頁面配置 ====================
 st.set_page_config(page_title="🔐 高效能無載體之機密編碼技術", page_icon="🔐", layout="wide", initial_sidebar_state="collapsed")
 
@@ -1886,7 +1782,8 @@ elif st.session_state.current_mode == 'embed':
         
         with col_right:
             if r['embed_secret_type'] == "文字":
-                z_text = ''.join(str(b) for b in r['z_bits'])
+                # Base45 只用 QR 英數模式的字元，比 0/1 字串小很多，較長的 Z 碼也放得進 QR Code
+                z_text = z_to_compact_text(r['z_bits'], 'base45')
                 style_num = r.get("style_num", 1)
                 img_num = r["embed_image_choice"].split("-")[1]
                 img_size = r["embed_image_choice"].split("-")[2]
@@ -1894,20 +1791,28 @@ elif st.session_state.current_mode == 'embed':
                 qr_content = f"{style_num}-{img_num}-{img_size}|{z_text}"
                 
                 try:
-                    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=2)
-                    qr.add_data(qr_content)
-                    qr.make(fit=True)
-                    qr_pil = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-                    
-                    buf = BytesIO()
-                    qr_pil.save(buf, format='PNG')
-                    qr_bytes = buf.getvalue()
+                    try:
+                        qr_images = [make_qr_png(qr_content)]
+                    except qrcode.exceptions.DataOverflowError:
+                        # 一張放不下：切成多張 QR Code，接收方一起上傳即可（順序不限）；
+                        # 超過 QR_MAX_PARTS 張時 split_z_payload 拋出 ValueError，改用下方的 Z碼圖
+                        qr_images = [make_qr_png(part) for part in split_z_payload(qr_content)]
                     
                     st.markdown('<p style="font-size: 38px; font-weight: bold; color: #443C3C; margin-bottom: 25px;">Z碼圖</p>', unsafe_allow_html=True)
-                    st.image(qr_bytes, width=200)
-                    st.download_button("下載 Z碼圖", qr_bytes, "z_code.png", "image/png", key="dl_z_qr")
+                    if len(qr_images) == 1:
+                        st.image(qr_images[0], width=200)
+                        st.download_button("下載 Z碼圖", qr_images[0], "z_code.png", "image/png", key="dl_z_qr")
+                    else:
+                        qr_cols = st.columns(min(len(qr_images), 3))
+                        for i, qr_bytes in enumerate(qr_images, start=1):
+                            with qr_cols[(i - 1) % len(qr_cols)]:
+                                st.image(qr_bytes, width=200)
+                                st.download_button(f"下載 Z碼圖 ({i}/{len(qr_images)})", qr_bytes, f"z_code_{i}_of_{len(qr_images)}.png", "image/png", key=f"dl_z_qr_{i}")
                     st.markdown('<p style="font-size: 38px; color: #443C3C; margin-top: 25px; margin-bottom: 0;">傳送 Z碼圖給對方</p>', unsafe_allow_html=True)
-                    st.markdown('<p style="font-size: 30px; color: #888; margin-top: 5px; white-space: nowrap;">接收方需要此 Z碼圖才能提取機密</p>', unsafe_allow_html=True)
+                    if len(qr_images) == 1:
+                        st.markdown('<p style="font-size: 30px; color: #888; margin-top: 5px; white-space: nowrap;">接收方需要此 Z碼圖才能提取機密</p>', unsafe_allow_html=True)
+                    else:
+                        st.markdown(f'<p style="font-size: 30px; color: #888; margin-top: 5px; white-space: nowrap;">接收方需要全部 {len(qr_images)} 張 Z碼圖才能提取機密</p>', unsafe_allow_html=True)
                 except:
                     style_num_int = int(style_num)
                     img_num_int = int(img_num)
@@ -1915,10 +1820,10 @@ elif st.session_state.current_mode == 'embed':
                     z_img, _ = encode_z_as_image_with_header(r['z_bits'], style_num_int, img_num_int, img_size_int)
                     
                     st.markdown('<p style="font-size: 38px; font-weight: bold; color: #443C3C; margin-bottom: 25px;">Z碼圖</p>', unsafe_allow_html=True)
+                    if count_z_parts(qr_content) > QR_MAX_PARTS:
+                        st.markdown(f'<p style="font-size: 24px; color: #856404; margin-bottom: 10px;">機密內容較長，超過 {QR_MAX_PARTS} 張 QR Code，改以 Z碼圖傳送</p>', unsafe_allow_html=True)
                     st.image(z_img, width=200)
-                    buf = BytesIO()
-                    z_img.save(buf, format='PNG')
-                    st.download_button("下載 Z碼圖", buf.getvalue(), "z_code.png", "image/png", key="dl_z_img_fallback")
+                    st.download_button("下載 Z碼圖", z_image_to_png(z_img), "z_code.png", "image/png", key="dl_z_img_fallback")
                     st.markdown('<p style="font-size: 38px; color: #443C3C; margin-top: 25px; margin-bottom: 0;">傳送 Z碼圖給對方</p>', unsafe_allow_html=True)
                     st.markdown('<p style="font-size: 30px; color: #888; margin-top: 5px; white-space: nowrap;">接收方需要此 Z碼圖才能提取機密</p>', unsafe_allow_html=True)
             else:
@@ -1929,9 +1834,7 @@ elif st.session_state.current_mode == 'embed':
                 
                 st.markdown('<p style="font-size: 38px; font-weight: bold; color: #443C3C; margin-bottom: 25px;">Z碼圖</p>', unsafe_allow_html=True)
                 st.image(z_img, width=200)
-                buf = BytesIO()
-                z_img.save(buf, format='PNG')
-                st.download_button("下載 Z碼圖", buf.getvalue(), "z_code.png", "image/png", key="dl_z_img")
+                st.download_button("下載 Z碼圖", z_image_to_png(z_img), "z_code.png", "image/png", key="dl_z_img")
                 st.markdown('<p style="font-size: 38px; color: #443C3C; margin-top: 25px; margin-bottom: 0;">傳送 Z碼圖給對方</p>', unsafe_allow_html=True)
                 st.markdown('<p style="font-size: 30px; color: #888; margin-top: 5px; white-space: nowrap;">接收方需要此 Z碼圖才能提取機密</p>', unsafe_allow_html=True)
         
@@ -2353,8 +2256,8 @@ elif st.session_state.current_mode == 'embed':
                         secret_desc = f"圖像: {secret_content.size[0]}×{secret_content.size[1]} px"
                         secret_filename = st.session_state.get('embed_secret_image_name', 'image.png')
                 
-                # 傳入 contact_key 進行嵌入
-                z_bits, used_capacity, info = embed_secret(img_process, secret_content, secret_type=secret_type_flag, contact_key=contact_key)
+                # 傳入 contact_key 進行嵌入（圖片庫載體的索引寫入磁碟，重新啟動後也不必重算）
+                z_bits, used_capacity, info = embed_secret(get_cover_index(img_process, persist=True), secret_content, secret_type=secret_type_flag, contact_key=contact_key, packed=True)
                 processing_placeholder.empty()
                 
                 st.session_state.embed_result = {
@@ -2705,6 +2608,7 @@ else:
         
         # 初始化提取變量
         extract_z_text = None
+        extract_z_image = None
         extract_style_num = None
         extract_img_num = None
         extract_img_size = None
@@ -2747,69 +2651,67 @@ else:
             """, unsafe_allow_html=True)
             
             if step1_done:
-                extract_file = st.file_uploader("上傳 QR Code 或 Z碼圖", type=["png", "jpg", "jpeg"], key="extract_z_upload", label_visibility="collapsed")
+                # 分段的 QR Code 可一次上傳多張（順序不限）
+                extract_files = st.file_uploader("上傳 QR Code 或 Z碼圖", type=["png", "jpg", "jpeg"], key="extract_z_upload", label_visibility="collapsed", accept_multiple_files=True)
                 
-                if extract_file:
+                if extract_files:
+                    extract_file = extract_files[0]
                     uploaded_img = Image.open(extract_file)
                     detected = False
                     success_msg = ""
                     error_msg = ""
+                    z_parts = []
                     
-                    # 先嘗試 QR Code
+                    # 先只讀取 Z碼圖的 header（v2 有識別碼可以直接判斷；舊版灰階格式沒有識別碼，等 QR Code 失敗後才採用）
                     try:
-                        decode_qr = load_pyzbar()
-                        decoded = decode_qr(uploaded_img)
-                        if decoded:
-                            qr_content = decoded[0].data.decode('utf-8')
-                            if '|' in qr_content:
-                                header, z_text = qr_content.split('|', 1)
-                                parts = header.split('-')
-                                if len(parts) == 3:
-                                    # 新格式: 風格編號-圖像編號-尺寸
-                                    extract_style_num = int(parts[0])
-                                    extract_img_num = int(parts[1])
-                                    extract_img_size = int(parts[2])
-                                    extract_z_text = z_text
-                                    style_name = NUM_TO_STYLE.get(extract_style_num, "建築")
-                                    images = IMAGE_LIBRARY.get(style_name, [])
-                                    img_name = images[extract_img_num - 1]['name'] if extract_img_num <= len(images) else str(extract_img_num)
-                                    success_msg = f"Z碼圖額外資訊：<br>風格：{extract_style_num}. {style_name}，載體圖像：{extract_img_num}（{img_name}），尺寸：{extract_img_size}×{extract_img_size}"
-                                    detected = True
-                                elif len(parts) == 2:
-                                    # 舊格式兼容: 圖像編號-尺寸
-                                    extract_style_num = 1  # 默認建築
-                                    extract_img_num = int(parts[0])
-                                    extract_img_size = int(parts[1])
-                                    extract_z_text = z_text
-                                    style_name = NUM_TO_STYLE.get(extract_style_num, "建築")
-                                    images = IMAGE_LIBRARY.get(style_name, [])
-                                    img_name = images[extract_img_num - 1]['name'] if extract_img_num <= len(images) else str(extract_img_num)
-                                    success_msg = f"Z碼圖額外資訊：<br>風格：{extract_style_num}. {style_name}，載體圖像：{extract_img_num}（{img_name}），尺寸：{extract_img_size}×{extract_img_size}"
-                                    detected = True
+                        z_header = peek_z_image_header(extract_file.getvalue())
                     except Exception as e:
-                        error_msg = f"QR: {str(e)}"
+                        z_header, z_header_error = None, str(e)
+                    
+                    if z_header and z_header[0] == 2:
+                        _, _, extract_style_num, extract_img_num, extract_img_size = z_header
+                        extract_z_image = extract_file.getvalue()
+                        detected = True
                     
-                    # 如果 QR 失敗，嘗試 Z碼圖
+                    # 再嘗試 QR Code（收集所有檔案中的 QR Code，分段的先組回完整內容）
                     if not detected:
                         try:
-                            z_bits, style_num, img_num, img_size = decode_image_to_z_with_header(uploaded_img)
-                            extract_style_num = style_num
-                            extract_img_num = img_num
-                            extract_img_size = img_size
-                            extract_z_text = ''.join(str(b) for b in z_bits)
-                            style_name = NUM_TO_STYLE.get(extract_style_num, "建築")
-                            images = IMAGE_LIBRARY.get(style_name, [])
-                            img_name = images[extract_img_num - 1]['name'] if extract_img_num <= len(images) else str(extract_img_num)
-                            success_msg = f"Z碼圖額外資訊：<br>風格：{extract_style_num}. {style_name}，載體圖像：{extract_img_num}（{img_name}），尺寸：{extract_img_size}×{extract_img_size}"
-                            detected = True
+                            qr_texts = []
+                            for f in extract_files:
+                                data = f.getvalue()
+                                qr_texts += decode_upload_qr(hashlib.sha256(data).hexdigest(), data)
+                            z_parts = [t for t in qr_texts if is_z_part(t)]
+                            if qr_texts:
+                                qr_content = join_z_parts(z_parts) if z_parts else qr_texts[0]
+                                extract_style_num, extract_img_num, extract_img_size, extract_z_text = parse_qr_header(qr_content)
+                                detected = True
                         except Exception as e:
-                            if error_msg:
-                                error_msg += f", {str(e)}"
-                            else:
-                                error_msg = str(e)
+                            error_msg = f"QR: {str(e)}"
+                    
+                    # 如果 QR 失敗，採用舊版 Z碼圖的 header（Z 碼在按下「開始提取」時才解碼）
+                    if not detected:
+                        if z_header:
+                            _, _, extract_style_num, extract_img_num, extract_img_size = z_header
+                            extract_z_image = extract_file.getvalue()
+                            detected = True
+                        elif error_msg:
+                            error_msg += f", {z_header_error}"
+                        else:
+                            error_msg = z_header_error
+                    
+                    if detected:
+                        style_name = NUM_TO_STYLE.get(extract_style_num, "建築")
+                        images = IMAGE_LIBRARY.get(style_name, [])
+                        img_name = images[extract_img_num - 1]['name'] if extract_img_num <= len(images) else str(extract_img_num)
+                        success_msg = f"Z碼圖額外資訊：<br>風格：{extract_style_num}. {style_name}，載體圖像：{extract_img_num}（{img_name}），尺寸：{extract_img_size}×{extract_img_size}"
+                        # 已知載體：背景先開始下載，按下「開始提取」時通常已下載完成
+                        if 1 <= extract_img_num <= len(images):
+                            prefetch_library_image(images[extract_img_num - 1]['id'], extract_img_size)
                     
                     # 顯示上傳的圖像和識別結果（並排）
                     if detected:
+                        if len(z_parts) > 1:
+                            success_msg += f"<br>已組合 {len(set(z_parts))} 張分段 QR Code"
                         img_bytes = extract_file.getvalue()
                         img_b64 = base64.b64encode(img_bytes).decode()
                         st.markdown(f'''
@@ -2840,7 +2742,7 @@ else:
             st.rerun()
         
         # ===== 開始提取按鈕 =====
-        if step1_done and extract_z_text and extract_style_num and extract_img_num and extract_img_size:
+        if step1_done and (extract_z_text or extract_z_image) and extract_style_num and extract_img_num and extract_img_size:
             btn_col1, btn_col2, btn_col3 = st.columns([1, 0.5, 1])
             with btn_col2:
                 extract_btn = st.button("開始提取", type="primary", key="extract_start_btn")
@@ -2886,8 +2788,16 @@ else:
                 
                 try:
                     start = time.time()
-                    clean = ''.join(c for c in extract_z_text.strip() if c in '01')
-                    Z = [int(b) for b in clean] if clean else None
+                    if extract_z_image is not None:
+                        # Z碼圖：上傳時只讀了 header，這裡才完整解碼（含 v2 的 CRC 檢查）
+                        Z = decode_image_to_z_with_header(Image.open(BytesIO(extract_z_image)), packed=True)[0]
+                    else:
+                        # 精簡格式（Base45 的字母表含空白，不能去掉空白）或舊的 0/1 字串
+                        if is_compact_z_text(extract_z_text):
+                            clean = extract_z_text
+                        else:
+                            clean = ''.join(c for c in extract_z_text.strip() if c in '01')
+                        Z = text_to_z(clean, packed=True) if clean else None
                     
                     # 取得對象密鑰
                     selected_contact = st.session_state.get('extract_contact_saved', None)
@@ -2902,8 +2812,8 @@ else:
                             selected_image = images[img_idx]
                             _, img_process = download_image_by_id(selected_image["id"], extract_img_size)
                             
-                            # 傳入 contact_key 進行提取
-                            secret, secret_type, info = detect_and_extract(img_process, Z, contact_key=contact_key)
+                            # 傳入 contact_key 進行提取（圖片庫載體的索引寫入磁碟）
+                            secret, secret_type, info = detect_and_extract(get_cover_index(img_process, strict=False, persist=True), Z, contact_key=contact_key)
                             processing_placeholder.empty()
                             
                             if secret_type == 'text':
@@ -1,8 +1,14 @@
 
 # 建立 mapping.py → 映射模組
 
+import numpy as np
+
 from config import MAPPING_TABLE, REVERSE_MAPPING_TABLE
 
+# 向量化用的查表陣列：索引為 [M 或 Z][MSB]
+Z_LOOKUP = np.array([[MAPPING_TABLE[(m, msb)] for msb in (0, 1)] for m in (0, 1)], dtype=np.uint8)
+M_LOOKUP = np.array([[REVERSE_MAPPING_TABLE[(z, msb)] for msb in (0, 1)] for z in (0, 1)], dtype=np.uint8)
+
 def map_to_z(secret_bit, msb):
   """
   功能:
@@ -48,3 +54,42 @@ def map_from_z(z_bit, msb):
   secret_bit = REVERSE_MAPPING_TABLE[key]
   
   return secret_bit
+
+def map_to_z_array(secret_bits, msbs):
+  """
+  功能:
+    正向映射的向量化版本：一次將整串秘密位元映射為 Z 碼
+
+  參數:
+    secret_bits: 秘密位元陣列 (0/1)
+    msbs: 對應的 MSB 陣列 (0/1)，長度需與 secret_bits 相同
+
+  返回:
+    z_bits: Z 碼位元陣列 (uint8)
+
+  原理:
+    直接以 MAPPING_TABLE 建立的 2×2 查表陣列做索引，結果與 map_to_z 逐位元相同
+  """
+  secret_bits = np.asarray(secret_bits, dtype=np.uint8)
+  msbs = np.asarray(msbs, dtype=np.uint8)
+  z_bits = Z_LOOKUP[secret_bits, msbs]
+
+  return z_bits
+
+def map_from_z_array(z_bits, msbs):
+  """
+  功能:
+    反向映射的向量化版本：一次從整串 Z 碼還原秘密位元
+
+  參數:
+    z_bits: Z 碼位元陣列 (0/1)
+    msbs: 對應的 MSB 陣列 (0/1)，長度需與 z_bits 相同
+
+  返回:
+    secret_bits: 還原的秘密位元陣列 (uint8)
+  """
+  z_bits = np.asarray(z_bits, dtype=np.uint8)
+  msbs = np.asarray(msbs, dtype=np.uint8)
+  secret_bits = M_LOOKUP[z_bits, msbs]
+
+  return secret_bits
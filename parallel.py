@@ -0,0 +1,157 @@
+# parallel.py → 多核心平行運算模組
+# 把載體依區塊列切成多個橫條，交給多個程序同時計算載體索引（21 個平均值的 MSB 與 Q）
+# 像素與結果都放在 multiprocessing.shared_memory，程序之間不需 pickle 任何陣列
+# 每個橫條的結果寫回固定位置，所以輸出與程序數量無關，和單核心計算逐位元相同
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import BLOCK_SIZE, Q_LENGTH, TOTAL_AVERAGES_PER_UNIT
+from block_engine import compute_block_msbs
+
+# 區塊數少於這個值時平行化的開銷大於收益，直接用單核心計算（512×512 = 4096 個區塊）
+PARALLEL_MIN_UNITS = 4096
+
+# 每個程序平均分到的橫條數，多切幾段讓較快的程序可以多做一些
+BANDS_PER_WORKER = 4
+
+MSB_BYTES_PER_UNIT = (TOTAL_AVERAGES_PER_UNIT + 7) // 8
+
+# 子程序內共用記憶體的對應（由 _init_worker 設定）
+_worker_state = {}
+
+def resolve_workers(workers):
+    """
+    功能:
+        將 workers 參數轉成實際的程序數量
+
+    參數:
+        workers: None 或 1 代表單核心；0 代表使用全部 CPU；其他正整數為程序數量
+
+    返回:
+        num_workers: 實際的程序數量 (>= 1)
+    """
+    if workers is None:
+        return 1
+    workers = int(workers)
+    if workers < 0:
+        raise ValueError(f"workers 不可為負數: {workers}")
+    if workers == 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def thread_map(func, items, workers=None):
+    """
+    功能:
+        依 workers 決定依序或以執行緒平行套用 func，結果順序與 items 相同
+        （用於多個對象、多張載體等彼此獨立、且共用大陣列不適合複製到子程序的工作）
+    """
+    items = list(items)
+    num_workers = min(resolve_workers(workers), len(items))
+    if num_workers <= 1:
+        return list(map(func, items))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(func, items))
+
+
+def split_block_rows(num_block_rows, num_bands):
+    """
+    功能:
+        將區塊列平均切成 num_bands 段
+
+    返回:
+        bands: [(起始區塊列, 結束區塊列), ...]，依序涵蓋全部區塊列
+    """
+    num_bands = max(1, min(num_bands, num_block_rows))
+    edges = np.linspace(0, num_block_rows, num_bands + 1).astype(int)
+    return [(int(edges[i]), int(edges[i + 1])) for i in range(num_bands) if edges[i] < edges[i + 1]]
+
+
+def _init_worker(gray_name, gray_shape, msb_name, q_name, num_units):
+    """
+    功能:
+        子程序啟動時連上主程序建立的共用記憶體（子程序與主程序共用同一個
+        resource_tracker，這裡不需 unlink，統一由主程序釋放）
+    """
+    gray_shm = shared_memory.SharedMemory(name=gray_name)
+    msb_shm = shared_memory.SharedMemory(name=msb_name)
+    q_shm = shared_memory.SharedMemory(name=q_name)
+
+    _worker_state['shm'] = (gray_shm, msb_shm, q_shm)
+    _worker_state['gray'] = np.ndarray(gray_shape, dtype=np.uint8, buffer=gray_shm.buf)
+    _worker_state['msb'] = np.ndarray((num_units, MSB_BYTES_PER_UNIT), dtype=np.uint8, buffer=msb_shm.buf)
+    _worker_state['Q'] = np.ndarray((num_units, Q_LENGTH), dtype=np.uint8, buffer=q_shm.buf)
+
+
+def _compute_band(band):
+    """
+    功能:
+        子程序：計算一個橫條內所有區塊的 MSB 與 Q，直接寫入共用記憶體的對應位置
+    """
+    row_start, row_stop = band
+    gray = _worker_state['gray']
+    num_cols = gray.shape[1] // BLOCK_SIZE
+
+    region = gray[row_start * BLOCK_SIZE:row_stop * BLOCK_SIZE]
+    unit_start, unit_stop = row_start * num_cols, row_stop * num_cols
+
+    _worker_state['msb'][unit_start:unit_stop], _worker_state['Q'][unit_start:unit_stop] = compute_block_msbs(region)
+
+    return band
+
+
+def compute_index_arrays(cover_gray, workers=None):
+    """
+    功能:
+        計算載體索引的兩個陣列，workers > 1 且載體夠大時以多個程序平行計算
+
+    參數:
+        cover_gray: 已預處理的灰階載體 (H×W)，H 與 W 皆為 8 的倍數
+        workers: 程序數量（見 resolve_workers）
+
+    返回:
+        msb_packed: (區塊數, 3) uint8，21 個平均值的 MSB（np.packbits 打包）
+        base_Q: (區塊數, 7) uint8，不含 contact_key 置換的 Q
+
+    流程:
+        1. 灰階像素複製到共用記憶體，另外配置兩塊共用記憶體存放結果
+        2. 依區塊列切成橫條，程序池依序處理，每段結果寫回自己的區塊範圍
+        3. 全部完成後把結果複製成一般陣列，釋放共用記憶體
+    """
+    height, width = cover_gray.shape
+    num_block_rows, num_cols = height // BLOCK_SIZE, width // BLOCK_SIZE
+    num_units = num_block_rows * num_cols
+    num_workers = min(resolve_workers(workers), num_block_rows)
+
+    if num_workers <= 1 or num_units < PARALLEL_MIN_UNITS:
+        return compute_block_msbs(cover_gray)
+
+    cover_gray = np.ascontiguousarray(cover_gray, dtype=np.uint8)
+
+    gray_shm = shared_memory.SharedMemory(create=True, size=cover_gray.nbytes)
+    msb_shm = shared_memory.SharedMemory(create=True, size=num_units * MSB_BYTES_PER_UNIT)
+    q_shm = shared_memory.SharedMemory(create=True, size=num_units * Q_LENGTH)
+    try:
+        np.ndarray(cover_gray.shape, dtype=np.uint8, buffer=gray_shm.buf)[:] = cover_gray
+
+        bands = split_block_rows(num_block_rows, num_workers * BANDS_PER_WORKER)
+        init_args = (gray_shm.name, cover_gray.shape, msb_shm.name, q_shm.name, num_units)
+        with multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=init_args) as pool:
+            completed = pool.map(_compute_band, bands)
+
+        if completed != bands:
+            raise RuntimeError("平行計算未完成所有區塊列")
+
+        msb_packed = np.ndarray((num_units, MSB_BYTES_PER_UNIT), dtype=np.uint8, buffer=msb_shm.buf).copy()
+        base_Q = np.ndarray((num_units, Q_LENGTH), dtype=np.uint8, buffer=q_shm.buf).copy()
+    finally:
+        for shm in (gray_shm, msb_shm, q_shm):
+            shm.close()
+            shm.unlink()
+
+    return msb_packed, base_Q
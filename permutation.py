@@ -2,6 +2,13 @@
 
 import numpy as np
 import hashlib
+from functools import lru_cache
+
+from config import BLOCK_SIZE
+from grayscale import luminance
+
+# 同時快取的對象密鑰數量上限
+KEY_PERMUTATION_CACHE_SIZE = 1024
 
 def generate_Q_from_block(block, q_length=7, contact_key=None):
     """
@@ -27,7 +34,7 @@ def generate_Q_from_block(block, q_length=7, contact_key=None):
     
     # 判斷圖片類型並取第一行
     if len(block.shape) == 3:  # 彩色區塊
-        first_row = (0.299 * block[0, :, 0] + 0.587 * block[0, :, 1] + 0.114 * block[0, :, 2]).astype(np.float64)
+        first_row = luminance(block[0])
     else:  # 灰階區塊
         first_row = block[0, :].astype(np.float64)
     
@@ -41,22 +48,46 @@ def generate_Q_from_block(block, q_length=7, contact_key=None):
     Q = (sorted_indices + 1).tolist()
     
     # 如果有 contact_key，對 Q 進行額外的確定性置換
-    if contact_key:
-        # 用 contact_key 生成一個固定的置換種子
-        key_hash = hashlib.sha256(contact_key.encode('utf-8')).digest()
-        perm_seed = int.from_bytes(key_hash[:4], 'big')
-        
-        # 用這個種子生成一個固定的置換
-        rng = np.random.default_rng(perm_seed)
-        perm_order = list(range(q_length))
-        rng.shuffle(perm_order)
-        
+    perm_order = get_key_permutation(contact_key, q_length)
+    if perm_order is not None:
         # 對 Q 應用這個置換
         Q = [Q[i] for i in perm_order]
     
     return Q
 
 
+@lru_cache(maxsize=KEY_PERMUTATION_CACHE_SIZE)
+def get_key_permutation(contact_key, q_length=7):
+    """
+    功能:
+        由 contact_key 推導對 Q 的額外置換順序（只與密鑰有關，與區塊無關）
+    
+    參數:
+        contact_key: 對象專屬密鑰（字串），None 或空字串代表不置換
+        q_length: Q 的長度，預設 7
+    
+    返回:
+        perm_order: 置換順序 tuple (0-based 索引)，沒有密鑰時返回 None
+    
+    注意:
+        結果以 LRU 快取，同一個密鑰只做一次 SHA-256 與亂數產生器初始化，
+        整張圖片的所有區塊（以及之後的每次呼叫）都共用同一個置換
+    """
+    if not contact_key:
+        return None
+    
+    # 用 contact_key 生成一個固定的置換種子
+    key_hash = hashlib.sha256(contact_key.encode('utf-8')).digest()
+    perm_seed = int.from_bytes(key_hash[:4], 'big')
+    
+    # 用這個種子生成一個固定的置換
+    rng = np.random.default_rng(perm_seed)
+    perm_order = list(range(q_length))
+    rng.shuffle(perm_order)
+    
+    return tuple(perm_order)
+
+
 def apply_permutation(values, Q):
     """
     功能:
@@ -102,3 +133,97 @@ def apply_Q_three_rounds(averages_21, Q):
     reordered_all = round1 + round2 + round3
     
     return reordered_all
+
+
+def generate_Q_matrix(image, q_length=7, contact_key=None, num_blocks=None):
+    """
+    功能:
+        一次為整張圖片所有 8×8 區塊生成排列密鑰 Q（generate_Q_from_block 的批次版本）
+    
+    參數:
+        image: numpy array，灰階圖片 (H×W) 或彩色圖片 (H×W×3)
+        q_length: Q 的長度，預設 7
+        contact_key: 對象專屬密鑰（字串）
+        num_blocks: 只生成前 num_blocks 個區塊（依列優先順序），None 代表全部
+    
+    返回:
+        Q_matrix: (區塊數, q_length) 的 uint8 陣列，每列為一個區塊的 Q (1-based 索引)
+    
+    原理:
+        只取每個區塊列的第一行像素，排成 (區塊數, q_length) 後沿 axis=1 做一次 argsort，
+        與逐區塊 np.argsort 使用相同的 float64 資料與排序方式，同值時的順序也相同
+    """
+    image = np.asarray(image)
+    height, width = image.shape[:2]
+    num_rows = height // BLOCK_SIZE
+    num_cols = width // BLOCK_SIZE
+    
+    if num_blocks is None:
+        num_blocks = num_rows * num_cols
+    if num_blocks == 0:
+        return np.zeros((0, q_length), dtype=np.uint8)
+    
+    # 只需要涵蓋前 num_blocks 個區塊的區塊列
+    num_block_rows = -(-num_blocks // num_cols)
+    first_rows = image[0:num_block_rows * BLOCK_SIZE:BLOCK_SIZE, :num_cols * BLOCK_SIZE]
+    
+    # 判斷圖片類型並取第一行（彩色區塊與 generate_Q_from_block 一樣使用未取整的亮度）
+    if len(image.shape) == 3:
+        first_rows = luminance(first_rows)
+    else:
+        first_rows = first_rows.astype(np.float64)
+    
+    # (區塊列, W) → (區塊數, 8) → 只取前 q_length 個像素
+    first_rows = first_rows.reshape(num_block_rows * num_cols, BLOCK_SIZE)[:num_blocks, :q_length]
+    sorted_indices = np.argsort(np.ascontiguousarray(first_rows), axis=1)
+    
+    # contact_key 的置換只算一次（有快取），一次套用到所有區塊
+    perm_order = get_key_permutation(contact_key, q_length)
+    if perm_order is not None:
+        sorted_indices = sorted_indices[:, list(perm_order)]
+    
+    # 轉換成 1-based 索引
+    Q_matrix = (sorted_indices + 1).astype(np.uint8)
+    
+    return Q_matrix
+
+
+def build_gather_index(Q_matrix, rounds=3):
+    """
+    功能:
+        把 Q 矩陣展開成 21 欄的取值索引（3 輪，每輪使用相同的 Q）
+    
+    參數:
+        Q_matrix: (區塊數, 7) 的 Q 陣列 (1-based 索引)
+        rounds: 重複使用輪數，預設 3
+    
+    返回:
+        gather_index: (區塊數, 7×rounds) 的 0-based 索引陣列
+    """
+    Q_zero_based = Q_matrix.astype(np.intp) - 1
+    q_length = Q_matrix.shape[1]
+    gather_index = np.concatenate([Q_zero_based + r * q_length for r in range(rounds)], axis=1)
+    
+    return gather_index
+
+
+def apply_Q_three_rounds_batch(all_averages, Q_matrix):
+    """
+    功能:
+        apply_Q_three_rounds 的批次版本：一次重新排列所有區塊的 21 個平均值
+    
+    參數:
+        all_averages: (區塊數, 21) 的平均值陣列
+        Q_matrix: (區塊數, 7) 的 Q 陣列 (1-based 索引)
+    
+    返回:
+        reordered_all: (區塊數, 21) 重新排列後的平均值陣列
+    """
+    if all_averages.shape[1] != 21:
+        raise ValueError(f"必須提供 21 個平均值，但收到 {all_averages.shape[1]} 個")
+    if Q_matrix.shape[1] != 7:
+        raise ValueError(f"Q 的長度必須是 7，但收到 {Q_matrix.shape[1]} 個")
+    
+    reordered_all = np.take_along_axis(all_averages, build_gather_index(Q_matrix), axis=1)
+    
+    return reordered_all
@@ -0,0 +1,264 @@
+# qr_decode.py → QR Code 辨識模組
+# 手機拍攝的 Z碼圖常是 12 MP 以上的大圖，直接交給 zbar 會花上數秒，還可能因光線不均而辨識失敗
+# 這裡先在縮小的灰階圖上找出 QR Code 定位圖案 (finder pattern)，只把候選區域裁切、縮放後交給 zbar；
+# 找不到時再依灰階金字塔由小到大、原圖與二值化圖輪流嘗試，同一張圖中的多個 QR Code 都會被辨識
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from grayscale import to_grayscale_pil
+
+# 金字塔最小一層的最長邊（每層縮小一半，直到不超過這個值）
+QR_BASE_SIDE = 1024
+
+# 裁切區域交給 zbar 前，每個模組 (module) 縮放到約多少像素
+QR_TARGET_MODULE_PX = 4
+
+# 二值化：像素比周圍平均暗這麼多才算黑色
+QR_BINARIZE_OFFSET = 8
+
+# 定位圖案中心到 QR Code 外框的距離（3.5 模組）加上留白與誤差，以模組為單位
+QR_REGION_PAD_MODULES = 10
+
+# 同一個 QR Code 的兩個定位圖案之間最遠的距離（版本 40 為 177 - 7 = 170 模組）
+QR_MAX_FINDER_DISTANCE = 170
+
+# 定位圖案黑白相間的比例 1:1:3:1:1 與允許的誤差（以模組大小為單位）
+FINDER_RATIO = np.array([1, 1, 3, 1, 1])
+FINDER_TOLERANCE = np.array([0.5, 0.5, 1.5, 0.5, 0.5])
+
+def zbar_decode(image):
+    """
+    功能:
+        以 zbar 辨識圖片中的所有 QR Code
+
+    返回:
+        symbols: [(文字, (left, top, width, height)), ...]
+
+    注意:
+        pyzbar 載入較慢，第一次呼叫時才載入；只搜尋 QR Code 可省下其他條碼格式的掃描時間
+    """
+    from pyzbar.pyzbar import decode, ZBarSymbol
+
+    return [
+        (symbol.data.decode('utf-8', errors='replace'), tuple(symbol.rect))
+        for symbol in decode(image, symbols=[ZBarSymbol.QRCODE])
+    ]
+
+
+def build_pyramid(gray, base_side=QR_BASE_SIDE):
+    """
+    功能:
+        建立灰階金字塔（每層長寬各縮小一半）
+
+    參數:
+        gray: L 模式 PIL Image
+        base_side: 最小一層的最長邊上限
+
+    返回:
+        levels: [(縮放倍率, PIL Image), ...]，由小到大，最後一層為原圖
+    """
+    levels = [(1, gray)]
+    while max(levels[-1][1].size) > base_side:
+        scale, image = levels[-1]
+        levels.append((scale * 2, image.reduce(2)))
+    return levels[::-1]
+
+
+def binarize(gray, offset=QR_BINARIZE_OFFSET):
+    """
+    功能:
+        局部平均二值化（比周圍平均暗 offset 以上為黑色），可處理拍照時的光線不均
+
+    參數:
+        gray: L 模式 PIL Image
+
+    返回:
+        binary: L 模式 PIL Image，黑色為 0、白色為 255
+
+    說明:
+        局部平均以 PIL 的 BoxBlur 計算（C 實作），不需要額外的整圖積分陣列
+    """
+    radius = max(7, min(gray.size) // 32)
+    mean = np.asarray(gray.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return Image.fromarray(np.where(pixels < mean - offset, 0, 255).astype(np.uint8))
+
+
+def scan_finder_runs(dark):
+    """
+    功能:
+        逐列找出符合 1:1:3:1:1 黑白比例的區段（定位圖案的水平切面）
+
+    參數:
+        dark: bool 陣列 (H×W)，True 為黑色
+
+    返回:
+        hits: (N, 3) float 陣列，每列為 (中心 x, y, 模組大小)
+    """
+    width = dark.shape[1]
+    hits = []
+
+    for y, row in enumerate(dark):
+        edges = np.flatnonzero(row[1:] != row[:-1]) + 1
+        if len(edges) < 4:
+            continue
+
+        bounds = np.concatenate(([0], edges, [width]))
+        starts, lengths = bounds[:-1], np.diff(bounds)
+
+        windows = np.lib.stride_tricks.sliding_window_view(lengths, 5)
+        module = windows.sum(axis=1) / 7
+        matches = np.all(np.abs(windows - module[:, None] * FINDER_RATIO) <= module[:, None] * FINDER_TOLERANCE, axis=1)
+        matches &= row[starts[:-4]] & (module >= 1)
+
+        for i in np.flatnonzero(matches):
+            hits.append((starts[i + 2] + lengths[i + 2] / 2, y, module[i]))
+
+    return np.array(hits, dtype=np.float64).reshape(-1, 3)
+
+
+def find_finder_patterns(binary):
+    """
+    功能:
+        找出定位圖案的中心
+
+    參數:
+        binary: binarize 的結果
+
+    返回:
+        finders: [(中心 x, 中心 y, 模組大小), ...]
+
+    流程:
+        1. 逐列與逐行各掃描一次 1:1:3:1:1 的區段
+        2. 只保留附近（一個模組內）同時有模組大小相近的垂直命中的水平命中，排除文字等雜訊
+        3. 相鄰的命中合併成同一個定位圖案；中間 3 模組高的黑色方塊每一列都會命中，
+           命中列數少於一個模組的視為資料區的巧合，捨棄
+    """
+    dark = np.asarray(binary) == 0
+    row_hits = scan_finder_runs(dark)
+    col_hits = scan_finder_runs(dark.T)[:, [1, 0, 2]]
+    if len(row_hits) == 0 or len(col_hits) == 0:
+        return []
+
+    confirmed = []
+    for start in range(0, len(row_hits), 1024):
+        chunk = row_hits[start:start + 1024]
+        dx = np.abs(chunk[:, None, 0] - col_hits[None, :, 0])
+        dy = np.abs(chunk[:, None, 1] - col_hits[None, :, 1])
+        dm = np.abs(chunk[:, None, 2] - col_hits[None, :, 2])
+        near = (dx <= chunk[:, None, 2]) & (dy <= chunk[:, None, 2]) & (dm <= 0.25 * chunk[:, None, 2])
+        confirmed.append(chunk[near.any(axis=1)])
+    confirmed = np.concatenate(confirmed)
+
+    clusters = []
+    for x, y, module in confirmed[np.argsort(confirmed[:, 1], kind='stable')]:
+        for cluster in clusters:
+            cx, cy = np.mean(cluster, axis=0)[:2]
+            if abs(x - cx) <= 2 * module and abs(y - cy) <= 4 * module:
+                cluster.append((x, y, module))
+                break
+        else:
+            clusters.append([(x, y, module)])
+
+    return [
+        (float(np.mean([h[0] for h in c])), float(np.mean([h[1] for h in c])), float(np.median([h[2] for h in c])))
+        for c in clusters if len(c) >= max(2, np.median([h[2] for h in c]))
+    ]
+
+
+def find_qr_regions(binary):
+    """
+    功能:
+        將定位圖案分組，推算每個 QR Code 的候選區域
+
+    參數:
+        binary: binarize 的結果
+
+    返回:
+        regions: [((left, top, right, bottom), 模組大小), ...]，座標為 binary 的像素座標
+
+    說明:
+        模組大小相近、距離在一個 QR Code 範圍內的定位圖案視為同一組；
+        每組至少要有兩個定位圖案（拍照時偶爾會漏掉一個），相鄰的多個 QR Code 可能併成一個區域，
+        zbar 仍會把區域中的每一個都辨識出來
+    """
+    finders = find_finder_patterns(binary)
+    groups = list(range(len(finders)))
+
+    def root(i):
+        while groups[i] != i:
+            i = groups[i]
+        return i
+
+    for i, (xi, yi, mi) in enumerate(finders):
+        for j in range(i + 1, len(finders)):
+            xj, yj, mj = finders[j]
+            similar = max(mi, mj) <= 1.25 * min(mi, mj)
+            if similar and np.hypot(xi - xj, yi - yj) <= QR_MAX_FINDER_DISTANCE * max(mi, mj):
+                groups[root(j)] = root(i)
+
+    width, height = binary.size
+    regions = []
+    for group in {root(i) for i in range(len(finders))}:
+        members = [f for i, f in enumerate(finders) if root(i) == group]
+        if len(members) < 2:
+            continue
+        xs, ys, modules = zip(*members)
+        module = float(np.median(modules))
+        pad = QR_REGION_PAD_MODULES * module
+        box = (max(0, int(min(xs) - pad)), max(0, int(min(ys) - pad)),
+               min(width, int(max(xs) + pad) + 1), min(height, int(max(ys) + pad) + 1))
+        regions.append((box, module))
+
+    return regions
+
+
+def decode_qr_texts(image, decode=None):
+    """
+    功能:
+        辨識圖片中所有 QR Code 的文字
+
+    參數:
+        image: PIL Image（任意模式、任意大小）
+        decode: 辨識函數（預設 zbar_decode），輸入 PIL Image，返回 [(文字, rect), ...]
+
+    返回:
+        texts: 文字列表（依找到的順序，不重複）
+
+    流程:
+        1. 轉灰階並建立金字塔，在最小一層二值化後找出候選 QR Code 區域
+        2. 每個區域從原圖裁切，縮放到每模組約 4 像素後辨識；失敗時改用二值化的裁切
+        3. 有區域沒辨識出來（或根本找不到區域）時，依金字塔由小到大辨識整張圖，
+           每層先試灰階、再試二值化，某一層有結果就停止
+    """
+    decode = decode or zbar_decode
+    gray = to_grayscale_pil(image)
+    levels = build_pyramid(gray)
+    base_scale, base = levels[0]
+
+    texts = {}
+
+    def attempt(candidate):
+        symbols = decode(candidate) or decode(binarize(candidate))
+        for text, _ in symbols:
+            texts.setdefault(text, None)
+        return bool(symbols)
+
+    regions = find_qr_regions(binarize(base))
+    all_decoded = True
+    for (left, top, right, bottom), module in regions:
+        crop = gray.crop((left * base_scale, top * base_scale, right * base_scale, bottom * base_scale))
+        factor = int(module * base_scale // QR_TARGET_MODULE_PX)
+        if factor > 1:
+            crop = crop.reduce(factor)
+        all_decoded &= attempt(crop)
+
+    if regions and all_decoded:
+        return list(texts)
+
+    for _, level in levels:
+        if attempt(level):
+            break
+
+    return list(texts)
@@ -0,0 +1,152 @@
+# qr_transport.py → 多張 QR Code 分段傳輸模組
+# Z 碼太長、一張 QR Code 放不下時，切成多段，每段加上訊息編號、序號/總數與 CRC，
+# 接收方不論上傳順序都能檢查並組回原本的內容
+
+import zlib
+
+# 分段格式：ZP1:{訊息編號}:{序號}:{總數}:{CRC}:{資料}
+#   訊息編號與 CRC 為 8 位大寫十六進位，序號從 1 起算；header 只用 QR 英數模式的字元
+Z_PART_PREFIX = 'ZP1:'
+
+# 每段資料的字元數（約 QR 版本 25～30，手機掃描仍然容易）
+QR_PART_CHARS = 1200
+
+# 最多切成幾張 QR Code；更長的 Z 碼（例如 4096×4096 載體約需 860 張）頁面無法顯示、
+# 也不可能一張張掃描，改用 Z碼圖傳送
+QR_MAX_PARTS = 12
+
+def _crc32_hex(text):
+    return f"{zlib.crc32(text.encode('utf-8')) & 0xFFFFFFFF:08X}"
+
+
+def count_z_parts(payload, max_chars=QR_PART_CHARS):
+    """
+    功能:
+        計算 split_z_payload 會切成幾段（不實際切割）
+    """
+    return max(1, -(-len(payload) // max_chars))
+
+
+def split_z_payload(payload, max_chars=QR_PART_CHARS, max_parts=QR_MAX_PARTS):
+    """
+    功能:
+        將 QR 內容切成多段，每段加上分段 header
+
+    參數:
+        payload: 完整的 QR 內容（例如「風格-圖像-尺寸|精簡 Z 碼」）
+        max_chars: 每段最多的資料字元數
+        max_parts: 最多段數，超過時拋出 ValueError（None 代表不限制）
+
+    返回:
+        parts: 分段字串列表（只有一段時也會加上 header）
+
+    注意:
+        訊息編號取自完整內容的 CRC32，同一份內容每次切出的分段都相同
+    """
+    if max_chars <= 0:
+        raise ValueError(f"max_chars 必須大於 0: {max_chars}")
+    count = count_z_parts(payload, max_chars)
+    if max_parts is not None and count > max_parts:
+        raise ValueError(f"Z 碼太長：需要 {count} 張 QR Code，超過上限 {max_parts} 張")
+
+    msg_id = _crc32_hex(payload)
+    chunks = [payload[i:i + max_chars] for i in range(0, len(payload), max_chars)] or ['']
+
+    return [
+        f"{Z_PART_PREFIX}{msg_id}:{index}:{count}:{_crc32_hex(chunk)}:{chunk}"
+        for index, chunk in enumerate(chunks, start=1)
+    ]
+
+
+def is_z_part(text):
+    """
+    功能:
+        判斷字串是否為分段格式
+    """
+    return text.startswith(Z_PART_PREFIX)
+
+
+def parse_z_part(text):
+    """
+    功能:
+        解析一段分段字串並檢查 CRC
+
+    返回:
+        msg_id: 訊息編號
+        index: 序號（從 1 起算）
+        count: 總段數
+        chunk: 這一段的資料
+    """
+    if not is_z_part(text):
+        raise ValueError("不是 QR 分段格式")
+
+    fields = text[len(Z_PART_PREFIX):].split(':', 4)
+    if len(fields) != 5:
+        raise ValueError("QR 分段 header 格式錯誤")
+
+    msg_id, index, count, crc, chunk = fields
+    if not (index.isdigit() and count.isdigit()) or not 1 <= int(index) <= int(count):
+        raise ValueError(f"QR 分段序號錯誤: {index}/{count}")
+    if _crc32_hex(chunk) != crc.upper():
+        raise ValueError(f"QR 分段 {index}/{count} 的 CRC 檢查失敗")
+
+    return msg_id.upper(), int(index), int(count), chunk
+
+
+def join_z_parts(texts):
+    """
+    功能:
+        將多段（順序不限、可重複）組回完整的 QR 內容
+
+    參數:
+        texts: 分段字串列表
+
+    返回:
+        payload: 完整內容
+
+    注意:
+        分段來自不同訊息、缺少分段或組回後的 CRC 與訊息編號不符時拋出 ValueError
+    """
+    parts = [parse_z_part(text) for text in texts]
+    if not parts:
+        raise ValueError("沒有任何 QR 分段")
+
+    msg_ids = {msg_id for msg_id, _, _, _ in parts}
+    if len(msg_ids) > 1:
+        raise ValueError(f"QR 分段來自不同的訊息: {', '.join(sorted(msg_ids))}")
+
+    count = parts[0][2]
+    if any(part_count != count for _, _, part_count, _ in parts):
+        raise ValueError("QR 分段的總數不一致")
+
+    chunks = {index: chunk for _, index, _, chunk in parts}
+    missing = [index for index in range(1, count + 1) if index not in chunks]
+    if missing:
+        raise ValueError(f"QR 分段不完整：缺少第 {'、'.join(map(str, missing))} 張（共 {count} 張）")
+
+    payload = ''.join(chunks[index] for index in range(1, count + 1))
+    if _crc32_hex(payload) != msg_ids.pop():
+        raise ValueError("QR 分段組合後的 CRC 檢查失敗")
+
+    return payload
+
+
+def parse_qr_header(qr_content):
+    """
+    功能:
+        解析 QR 內容的 header「風格編號-圖像編號-尺寸|Z碼」（舊格式「圖像編號-尺寸|Z碼」預設風格 1）
+
+    返回:
+        style_num, img_num, img_size: 風格編號、圖像編號、載體圖像尺寸
+        z_text: Z 碼文字（不解碼）
+    """
+    header, sep, z_text = qr_content.partition('|')
+    fields = header.split('-')
+    if not sep or len(fields) not in (2, 3) or not all(field.isdigit() for field in fields):
+        raise ValueError("QR 內容格式錯誤")
+
+    if len(fields) == 2:
+        fields = ['1'] + fields
+    style_num, img_num, img_size = map(int, fields)
+
+    return style_num, img_num, img_size, z_text
@@ -6,23 +6,25 @@ import numpy as np
 import math
 from PIL import Image
 
+from bit_buffer import BitBuffer, as_bit_array, bytes_to_bits, bits_to_bytes
+
 # 文字編碼
-def text_to_binary(text):
+def text_to_binary(text, packed=False):
     """
     功能:
         將文字轉成 UTF-8 二進位列表
     
     參數:
         text: 要編碼的文字字串
+        packed: True 時直接返回 BitBuffer（不經過位元列表）
     
     返回:
-        bits: 二進位列表
+        bits: 二進位列表或 BitBuffer
     """
-    bits = []
-    for byte in text.encode('utf-8'):
-        for b in format(byte, '08b'):
-            bits.append(int(b))
-    return bits
+    if packed:
+        return BitBuffer.from_bytes(text.encode('utf-8'))
+    
+    return bytes_to_bits(text.encode('utf-8')).tolist()
 
 def binary_to_text(binary):
     """
@@ -30,21 +32,16 @@ def binary_to_text(binary):
         將二進位列表轉回文字
     
     參數:
-        binary: 二進位列表
+        binary: 二進位列表或 BitBuffer
     
     返回:
         text: 解碼後的文字
     """
-    byte_list = []
-    for i in range(0, len(binary), 8):
-        byte = binary[i:i+8]
-        if len(byte) == 8:
-            byte_value = int(''.join(map(str, byte)), 2)
-            byte_list.append(byte_value)
-    return bytes(byte_list).decode('utf-8', errors='ignore')
+    # 只取完整的 byte，不足 8 bits 的尾端捨棄
+    return bits_to_bytes(binary).decode('utf-8', errors='ignore')
 
 # 圖片編碼
-def image_to_binary(image, capacity=None):
+def image_to_binary(image, capacity=None, packed=False):
     """
     功能:
         將圖片轉成二進位列表（含 header）
@@ -52,9 +49,10 @@ def image_to_binary(image, capacity=None):
     參數:
         image: PIL Image 物件
         capacity: 可用容量（bits），用於判斷是否需要縮放
+        packed: True 時返回 BitBuffer
     
     返回:
-        binary: 二進位列表
+        binary: 二進位列表或 BitBuffer
         orig_size: 原始尺寸 (width, height)
         mode: 原始色彩模式
     
@@ -94,15 +92,6 @@ def image_to_binary(image, capacity=None):
         image = image.convert('RGB')
         has_alpha = False
     
-    # 建立 header（前 34 bits：原始尺寸 + 模式）
-    binary = []
-    for b in format(orig_size[0], '016b'):
-        binary.append(int(b))
-    for b in format(orig_size[1], '016b'):
-        binary.append(int(b))
-    binary.append(1 if is_color else 0)
-    binary.append(1 if has_alpha else 0)
-    
     # 計算每像素 bits
     if is_color:
         bpp = 32 if has_alpha else 24
@@ -127,23 +116,24 @@ def image_to_binary(image, capacity=None):
     # 縮放圖片
     image = image.resize(new_size, Image.Resampling.LANCZOS)
     
-    # 加入縮放後尺寸（32 bits）
-    for b in format(new_size[0], '016b'):
-        binary.append(int(b))
-    for b in format(new_size[1], '016b'):
-        binary.append(int(b))
+    # 建立 header（66 bits）：原始尺寸 32 bits + 模式 2 bits + 縮放後尺寸 32 bits
+    header = (
+        (orig_size[0] << 50) | (orig_size[1] << 34) |
+        ((1 if is_color else 0) << 33) | ((1 if has_alpha else 0) << 32) |
+        (new_size[0] << 16) | new_size[1]
+    )
+    header_buffer = BitBuffer.from_bytes((header << 6).to_bytes(9, 'big'), 66)
     
-    # 加入像素資料
+    # 加入像素資料：依列優先順序，每個像素依序放入各通道的 8 bits
+    pixels = np.asarray(image, dtype=np.uint8)
     if is_color:
-        for px in list(image.getdata()):
-            channels = 4 if has_alpha else 3
-            for v in px[:channels]:
-                for b in format(v, '08b'):
-                    binary.append(int(b))
-    else:
-        for px in list(image.getdata()):
-            for b in format(px, '08b'):
-                binary.append(int(b))
+        channels = 4 if has_alpha else 3
+        pixels = pixels[:, :, :channels]
+    
+    binary = header_buffer + BitBuffer.from_bytes(np.ascontiguousarray(pixels).tobytes())
+    
+    if not packed:
+        binary = binary.tolist()
     
     return binary, orig_size, mode
 
@@ -153,57 +143,61 @@ def binary_to_image(binary):
         將二進位列表轉回圖片
     
     參數:
-        binary: 二進位列表
+        binary: 二進位列表或 BitBuffer
     
     返回:
         image: PIL Image 物件（還原到原始尺寸）
         orig_size: 原始尺寸 (width, height)
         is_color: 是否為彩色
     """
+    bits = as_bit_array(binary)
+    
     try:
-        # 解析 header
-        w = int(''.join(map(str, binary[0:16])), 2)
-        h = int(''.join(map(str, binary[16:32])), 2)
-        is_color = binary[32]
-        has_alpha = binary[33]
+        # 解析 header（只有 66 bits，長度不足時與原本一樣從現有的位元解析）
+        header = bits[:66].tolist()
+        w = int(''.join(map(str, header[0:16])), 2)
+        h = int(''.join(map(str, header[16:32])), 2)
+        is_color = header[32]
+        has_alpha = header[33]
         idx = 34
         
         # 解析縮放後尺寸
-        sw = int(''.join(map(str, binary[idx:idx+16])), 2)
-        sh = int(''.join(map(str, binary[idx+16:idx+32])), 2)
+        sw = int(''.join(map(str, header[idx:idx+16])), 2)
+        sh = int(''.join(map(str, header[idx+16:idx+32])), 2)
         idx += 32
         
+        payload = bits[idx:]
+        num_pixels = sw * sh
+        
+        # 密鑰錯誤時 header 是亂碼，縮放後尺寸可能大到無法配置：超過 PIL 的像素上限、
+        # 而且剩餘位元數也填不滿（正確的資料每像素至少 8 bits）時拒絕；
+        # 原始尺寸 w×h 由嵌入端決定，照舊還原不設限
+        limit = Image.MAX_IMAGE_PIXELS
+        if limit and num_pixels > limit and num_pixels > len(payload) // 8 + 1:
+            raise ValueError(f"縮放後尺寸過大: {sw}×{sh}，只有 {len(payload)} bits")
+        
         if is_color:
-            # 彩色圖片
-            pixels = []
-            for _ in range(sw * sh):
-                if has_alpha and idx + 32 <= len(binary):
-                    pixel = tuple(
-                        int(''.join(map(str, binary[idx+i*8:idx+(i+1)*8])), 2)
-                        for i in range(4)
-                    )
-                    pixels.append(pixel)
-                    idx += 32
-                elif idx + 24 <= len(binary):
-                    pixel = tuple(
-                        int(''.join(map(str, binary[idx+i*8:idx+(i+1)*8])), 2)
-                        for i in range(3)
-                    )
-                    pixels.append(pixel)
-                    idx += 24
+            # 彩色圖片：每像素 4 或 3 個通道，資料不足時缺少的像素保持 0
+            channels = 4 if has_alpha else 3
+            pixels = np.zeros((num_pixels, channels), dtype=np.uint8)
             
-            img = Image.new('RGBA' if has_alpha else 'RGB', (sw, sh))
-            img.putdata(pixels[:sw*sh])
+            count = min(num_pixels, len(payload) // (channels * 8))
+            pixels[:count] = np.packbits(payload[:count * channels * 8]).reshape(count, channels)
+            
+            # 有透明通道但剩下的位元只夠 3 個通道時，最後一個像素以不透明的 RGB 補上
+            rest = payload[count * channels * 8:]
+            if has_alpha and count < num_pixels and len(rest) >= 24:
+                pixels[count] = np.append(np.packbits(rest[:24]), 255)
+            
+            img = Image.fromarray(pixels.reshape(sh, sw, channels), 'RGBA' if has_alpha else 'RGB')
         else:
             # 灰階圖片
-            pixels = []
-            for i in range(sw * sh):
-                if idx + (i+1) * 8 <= len(binary):
-                    pixel = int(''.join(map(str, binary[idx+i*8:idx+(i+1)*8])), 2)
-                    pixels.append(pixel)
+            pixels = np.zeros(num_pixels, dtype=np.uint8)
+            
+            count = min(num_pixels, len(payload) // 8)
+            pixels[:count] = np.packbits(payload[:count * 8])
             
-            img = Image.new('L', (sw, sh))
-            img.putdata(pixels[:sw*sh])
+            img = Image.fromarray(pixels.reshape(sh, sw), 'L')
         
         # 還原到原始尺寸
         img = img.resize((w, h), Image.Resampling.LANCZOS)
@@ -213,7 +207,7 @@ def binary_to_image(binary):
     except Exception as e:
         return None, None, None
 
-def encode_secret(secret, secret_type='text', capacity=None):
+def encode_secret(secret, secret_type='text', capacity=None, packed=False):
     """
     功能:
         將機密內容（文字或圖片）編碼成二進位
@@ -222,16 +216,17 @@ def encode_secret(secret, secret_type='text', capacity=None):
         secret: 機密內容（字串或 PIL Image）
         secret_type: 'text' 或 'image'
         capacity: 可用容量（僅圖片需要）
+        packed: True 時返回 BitBuffer
     
     返回:
-        binary: 二進位列表
+        binary: 二進位列表或 BitBuffer
         info: 額外資訊（文字長度或圖片尺寸）
     """
     if secret_type == 'text':
-        binary = text_to_binary(secret)
+        binary = text_to_binary(secret, packed=packed)
         info = {'type': 'text', 'length': len(secret)}
     else:
-        binary, orig_size, mode = image_to_binary(secret, capacity)
+        binary, orig_size, mode = image_to_binary(secret, capacity, packed=packed)
         info = {'type': 'image', 'size': orig_size, 'mode': mode}
     
     return binary, info
@@ -243,7 +238,7 @@ def decode_secret(binary, secret_type='text'):
         將二進位解碼成機密內容
     
     參數:
-        binary: 二進位列表
+        binary: 二進位列表或 BitBuffer
         secret_type: 'text' 或 'image'
     
     返回:
@@ -1,32 +1,267 @@
 
 # 建立 text_encoding.py → Z碼文字編碼模組
 
+import base64
+
+import numpy as np
+
+from bit_buffer import BitBuffer
+
+# 精簡 Z 碼文字格式：Z1{編碼代號}:{Z 碼位元數}:{資料}
+#   Z1 為格式版本；資料為打包後 Z 碼（MSB first，最後不足 8 bits 補 0）的文字編碼
+#   U = Base64url（無 = 補位）、A = Base85、Q = Base45（只用 QR 英數模式的字元，適合 QR Code）
+Z_TEXT_PREFIX = 'Z1'
+Z_TEXT_CODECS = {'base64url': 'U', 'base85': 'A', 'base45': 'Q'}
+Z_TEXT_CODEC_NAMES = {code: name for name, code in Z_TEXT_CODECS.items()}
+
+BASE45_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+BASE85_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz!#$%&()*+-;<=>?@^_`{|}~'
+
+def _make_decode_table(alphabet):
+  table = np.full(256, 255, dtype=np.uint8)
+  table[np.frombuffer(alphabet.encode('ascii'), dtype=np.uint8)] = np.arange(len(alphabet))
+  return table
+
+_BASE45_CHARS = np.frombuffer(BASE45_ALPHABET.encode('ascii'), dtype=np.uint8)
+_BASE45_DECODE = _make_decode_table(BASE45_ALPHABET)
+_BASE85_CHARS = np.frombuffer(BASE85_ALPHABET.encode('ascii'), dtype=np.uint8)
+_BASE85_DECODE = _make_decode_table(BASE85_ALPHABET)
+
 def z_to_text(z_bits):
   """
   功能:
     將 Z 碼編碼成文字格式 (二進位字串)
 
   參數:
-    z_bits: Z 碼位元列表
+    z_bits: Z 碼位元列表或 BitBuffer
 
   返回:
     z_text: 二進位字串
   """
+  if isinstance(z_bits, BitBuffer):
+    # 0/1 加上 ord('0') 後直接當成 ASCII bytes
+    return (z_bits.unpack() + ord('0')).tobytes().decode('ascii')
+
   z_text = ''.join(str(bit) for bit in z_bits)
 
   return z_text
 
-def text_to_z(z_text):
+def text_to_z(z_text, packed=False):
   """
   功能:
     從文字格式解碼 Z 碼
 
   參數:
-    z_text: 二進位字串
+    z_text: 二進位字串或精簡格式字串
+    packed: True 時返回 BitBuffer
 
   返回:
-    z_bits: Z 碼位元列表
+    z_bits: Z 碼位元列表或 BitBuffer
+
+  說明:
+    同時支援原本的 0/1 字串與精簡格式（Z1 開頭，見 z_to_compact_text），自動判斷
   """
+  if is_compact_z_text(z_text):
+    return compact_text_to_z(z_text, packed=packed)
+
+  if packed:
+    bits = np.frombuffer(z_text.encode('ascii'), dtype=np.uint8) - ord('0')
+    if bits.size and bits.max() > 1:
+      raise ValueError("Z 碼文字只能包含 0 和 1")
+    return BitBuffer.from_bits(bits)
+
   z_bits = [int(bit) for bit in z_text]
 
   return z_bits
+
+def _text_digits(text, decode_table, name):
+  """
+  功能:
+    將編碼文字轉成每個字元在字母表中的數值，遇到不合法字元時報錯
+  """
+  try:
+    raw = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+  except UnicodeEncodeError:
+    raise ValueError(f"{name} 資料含有非 ASCII 字元")
+  digits = decode_table[raw]
+  if digits.size and digits.max() == 255:
+    raise ValueError(f"{name} 資料含有不合法的字元")
+  return digits
+
+def base45_encode(data):
+  """
+  功能:
+    Base45 編碼（RFC 9285）：每 2 bytes → 3 個字元，最後剩 1 byte → 2 個字元
+  """
+  values = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+  num_pairs = len(values) // 2
+
+  pairs = values[:num_pairs * 2].reshape(-1, 2)
+  pairs = pairs[:, 0] * 256 + pairs[:, 1]
+  digits = np.stack([pairs % 45, pairs // 45 % 45, pairs // 2025], axis=1).reshape(-1)
+
+  if len(values) % 2:
+    last = values[-1]
+    digits = np.concatenate([digits, [last % 45, last // 45]])
+
+  return _BASE45_CHARS[digits.astype(np.intp)].tobytes().decode('ascii')
+
+def base45_decode(text):
+  """
+  功能:
+    Base45 解碼（RFC 9285）
+  """
+  digits = _text_digits(text, _BASE45_DECODE, 'Base45').astype(np.uint32)
+  if len(digits) % 3 == 1:
+    raise ValueError("Base45 資料長度錯誤")
+
+  num_groups = len(digits) // 3
+  groups = digits[:num_groups * 3].reshape(-1, 3)
+  values = groups[:, 0] + groups[:, 1] * 45 + groups[:, 2] * 2025
+  if values.size and values.max() > 0xFFFF:
+    raise ValueError("Base45 資料數值超出範圍")
+  data = np.stack([values >> 8, values & 0xFF], axis=1).reshape(-1)
+
+  if len(digits) % 3 == 2:
+    last = digits[-2] + digits[-1] * 45
+    if last > 0xFF:
+      raise ValueError("Base45 資料數值超出範圍")
+    data = np.concatenate([data, [last]])
+
+  return data.astype(np.uint8).tobytes()
+
+def base85_encode(data):
+  """
+  功能:
+    Base85 編碼（與 base64.b85encode 相同）：每 4 bytes → 5 個字元，最後不足 4 bytes 時少輸出補位的字元數
+  """
+  padding = -len(data) % 4
+  words = np.frombuffer(data + b'\0' * padding, dtype='>u4').astype(np.uint64)
+
+  digits = np.empty((len(words), 5), dtype=np.uint64)
+  for i in range(4, -1, -1):
+    digits[:, i] = words % 85
+    words //= 85
+
+  chars = _BASE85_CHARS[digits.reshape(-1).astype(np.intp)].tobytes().decode('ascii')
+
+  return chars[:len(chars) - padding] if padding else chars
+
+def base85_decode(text):
+  """
+  功能:
+    Base85 解碼（與 base64.b85decode 相同）
+  """
+  digits = _text_digits(text, _BASE85_DECODE, 'Base85')
+  padding = -len(digits) % 5
+  if padding == 4:
+    raise ValueError("Base85 資料長度錯誤")
+  digits = np.concatenate([digits, np.full(padding, 84, dtype=np.uint8)]).astype(np.uint64).reshape(-1, 5)
+
+  words = np.zeros(len(digits), dtype=np.uint64)
+  for i in range(5):
+    words = words * 85 + digits[:, i]
+  if words.size and words.max() > 0xFFFFFFFF:
+    raise ValueError("Base85 資料數值超出範圍")
+
+  data = words.astype('>u4').tobytes()
+
+  return data[:len(data) - padding] if padding else data
+
+def z_to_compact_text(z_bits, codec='base64url'):
+  """
+  功能:
+    將 Z 碼編碼成精簡文字格式 Z1{編碼代號}:{位元數}:{資料}
+
+  參數:
+    z_bits: Z 碼位元列表或 BitBuffer
+    codec: 'base64url'、'base85' 或 'base45'（QR Code 英數模式）
+
+  返回:
+    z_text: 精簡格式字串（長度約為二進位字串的 1/6 ~ 1/5）
+  """
+  if codec not in Z_TEXT_CODECS:
+    raise ValueError(f"不支援的 Z 碼文字編碼: {codec}")
+
+  z_buffer = BitBuffer.from_bits(z_bits)
+  data = z_buffer.to_bytes()
+
+  if codec == 'base64url':
+    payload = base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+  elif codec == 'base85':
+    payload = base85_encode(data)
+  else:
+    payload = base45_encode(data)
+
+  return f"{Z_TEXT_PREFIX}{Z_TEXT_CODECS[codec]}:{len(z_buffer)}:{payload}"
+
+def is_compact_z_text(z_text):
+  """
+  功能:
+    判斷字串是否為精簡 Z 碼文字格式（前後空白不影響判斷）
+  """
+  head = z_text.lstrip()[:len(Z_TEXT_PREFIX) + 2]
+  return (
+    len(head) == len(Z_TEXT_PREFIX) + 2 and head.startswith(Z_TEXT_PREFIX)
+    and head[len(Z_TEXT_PREFIX)] in Z_TEXT_CODEC_NAMES and head[-1] == ':'
+  )
+
+def _compact_header(z_text):
+  """
+  功能:
+    解析精簡文字格式的 header，返回 (編碼名稱, 位元數, 資料)
+  """
+  z_text = z_text.lstrip().rstrip('\r\n')
+  if not is_compact_z_text(z_text):
+    raise ValueError("不是精簡 Z 碼文字格式")
+
+  codec = Z_TEXT_CODEC_NAMES[z_text[len(Z_TEXT_PREFIX)]]
+  length_text, _, payload = z_text[len(Z_TEXT_PREFIX) + 2:].partition(':')
+  if not length_text.isdigit():
+    raise ValueError(f"Z 碼位元數格式錯誤: {length_text}")
+
+  return codec, int(length_text), payload
+
+def z_text_bit_length(z_text):
+  """
+  功能:
+    不解碼資料，取得 Z 碼文字的位元數（精簡格式讀 header，舊的 0/1 字串直接計數）
+  """
+  if is_compact_z_text(z_text):
+    return _compact_header(z_text)[1]
+  return z_text.count('0') + z_text.count('1')
+
+def compact_text_to_z(z_text, packed=False):
+  """
+  功能:
+    從精簡文字格式解碼 Z 碼
+
+  參數:
+    z_text: Z1{編碼代號}:{位元數}:{資料}
+    packed: True 時返回 BitBuffer
+
+  返回:
+    z_bits: Z 碼位元列表或 BitBuffer
+
+  注意:
+    Base45 的字母表包含空白，所以資料後面的空白不能去掉（只去掉開頭空白與結尾換行）
+  """
+  codec, length, payload = _compact_header(z_text)
+
+  if codec == 'base64url':
+    payload = payload.strip()
+    try:
+      data = base64.b64decode(payload + '=' * (-len(payload) % 4), altchars=b'-_', validate=True)
+    except ValueError as e:
+      raise ValueError(f"Base64url 資料錯誤: {e}")
+  elif codec == 'base85':
+    data = base85_decode(payload.strip())
+  else:
+    data = base45_decode(payload)
+
+  if length > len(data) * 8 or len(data) != -(-length // 8):
+    raise ValueError(f"Z 碼位元數 ({length}) 與資料長度 ({len(data)} bytes) 不符")
+
+  z_bits = BitBuffer.from_bytes(data, length)
+
+  return z_bits if packed else z_bits.tolist()
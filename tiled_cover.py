@@ -0,0 +1,291 @@
+# tiled_cover.py → 大型載體分段讀取模組
+# 超大載體（例如 20k×20k 以上的 TIFF / PNG 掃描檔）依 8 的倍數列切成橫條逐段處理，
+# 峰值記憶體只與橫條大小有關：未壓縮的格式以記憶體映射 (memmap) 讀取，PNG 逐條解壓縮；
+# 其他壓縮格式（JPEG、壓縮 TIFF 等）PIL 只能整張解碼，仍受 PIL 預設的像素上限限制
+
+import io
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image, PngImagePlugin, PpmImagePlugin, TiffImagePlugin
+
+from config import BLOCK_SIZE
+from grayscale import to_grayscale
+from image_encoding import PNG_SIGNATURE, PNG_COLOR_MODES
+
+# 每個橫條的列數（必須是 8 的倍數）；20k 寬的 RGB 橫條約 60 MB
+TILED_STRIP_ROWS = 1024
+
+# 可以 memmap 或逐條解壓縮的大型載體允許的最大像素數（None 代表不限制）；
+# 這些格式的峰值記憶體只與橫條大小有關，因此可以超過 PIL 預設的 Image.MAX_IMAGE_PIXELS（約 0.9 億）
+TILED_MAX_PIXELS = 2_000_000_000
+
+# 可以直接 memmap 或逐條解壓縮的像素格式與通道數
+RAW_MODE_CHANNELS = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+# 可能不需要整張解碼的格式：直接以格式外掛的類別開啟（只讀取檔頭）
+HEADER_ONLY_FORMATS = {
+    'PNG': PngImagePlugin.PngImageFile,
+    'TIFF': TiffImagePlugin.TiffImageFile,
+    'PPM': PpmImagePlugin.PpmImageFile,
+}
+
+class PngStripReader:
+    """
+    功能:
+        逐條解壓縮非交錯、8 bits 的灰階 / RGB / RGBA PNG，只保留目前橫條的像素
+
+    原理:
+        PNG 每列的濾波只參考左邊與上一列，所以只要記住上一條的最後一列，就能接著還原下一條：
+        把「上一列（不濾波）+ 本條的原始濾波資料」包成一張小 PNG（zlib 不壓縮），交給 PIL 的 C 解碼器還原
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(33)
+        if header[:8] != PNG_SIGNATURE or header[12:16] != b'IHDR':
+            raise ValueError(f"不是 PNG 檔: {path}")
+
+        width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', header[16:29])
+        if depth != 8 or interlace or color not in PNG_COLOR_MODES:
+            raise ValueError(f"不支援逐條讀取的 PNG 格式（{depth} bits、色彩類型 {color}、交錯 {interlace}）")
+
+        self.ihdr = header[16:29]
+        self.mode = PNG_COLOR_MODES[color]
+        channels = RAW_MODE_CHANNELS[self.mode]
+        self.shape = (height, width) if channels == 1 else (height, width, channels)
+        self.row_bytes = width * channels
+        self._rewind()
+
+    def _rewind(self):
+        """回到第 0 列"""
+        self.file = open(self.path, 'rb')
+        self.file.seek(len(PNG_SIGNATURE))
+        self.decompressor = zlib.decompressobj()
+        self.raw = bytearray()
+        self.next_row = 0
+        self.prev_row = bytes(self.row_bytes)
+
+    def _next_idat(self):
+        """讀取下一個 IDAT 區塊的資料（略過其他區塊）"""
+        while True:
+            chunk_header = self.file.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError(f"PNG 資料不完整: {self.path}")
+            length, chunk_type = struct.unpack('>I4s', chunk_header)
+            body = self.file.read(length)
+            self.file.seek(4, os.SEEK_CUR)
+            if chunk_type == b'IDAT':
+                return body
+            if chunk_type == b'IEND':
+                raise ValueError(f"PNG 資料不完整: {self.path}")
+
+    def _decode_rows(self, count):
+        """還原接下來的 count 列"""
+        needed = count * (self.row_bytes + 1)
+        while len(self.raw) < needed:
+            data = self.decompressor.unconsumed_tail or self._next_idat()
+            self.raw += self.decompressor.decompress(data, needed - len(self.raw))
+
+        # 上一列以濾波類型 0 放在最前面，本條第一列的濾波才能參考到它
+        data = b'\x00' + self.prev_row + self.raw[:needed]
+        del self.raw[:needed]
+        ihdr = struct.pack('>II', self.shape[1], count + 1) + self.ihdr[8:]
+        png = PNG_SIGNATURE
+        for chunk_type, body in ((b'IHDR', ihdr), (b'IDAT', zlib.compress(data, 0)), (b'IEND', b'')):
+            png += struct.pack('>I', len(body)) + chunk_type + body + struct.pack('>I', zlib.crc32(chunk_type + body))
+
+        rows = np.asarray(PngImagePlugin.PngImageFile(io.BytesIO(png)))[1:]
+        self.prev_row = rows[-1].tobytes()
+        self.next_row += count
+        return rows
+
+    def read_rows(self, top, bottom):
+        """
+        功能:
+            讀取第 top 到 bottom 列（往回讀時從頭重新解壓縮）
+        """
+        if top < self.next_row:
+            self.file.close()
+            self._rewind()
+        while self.next_row < top:
+            self._decode_rows(min(TILED_STRIP_ROWS, top - self.next_row))
+        return self._decode_rows(bottom - top)
+
+
+def open_image_file(path, max_pixels=TILED_MAX_PIXELS):
+    """
+    功能:
+        開啟圖片檔，盡量取得不需要整張解碼的像素來源
+
+    參數:
+        path: 圖片檔路徑
+        max_pixels: 可以 memmap 或逐條解壓縮時允許的最大像素數
+
+    返回:
+        pixels: np.memmap（未壓縮 TIFF、PPM/PGM）、PngStripReader（非交錯 8 bits PNG）
+                或 PIL Image（其他格式）
+
+    注意:
+        只有前兩種的記憶體用量與圖片大小無關，才放寬到 max_pixels；其他格式（JPEG、壓縮 TIFF、
+        交錯或調色盤 PNG 等）讀取任何一列都會整張解碼，改以 Image.open 開啟，沿用 PIL 預設的像素上限。
+        放寬上限是直接以格式外掛的類別只讀取檔頭，不修改全域的 Image.MAX_IMAGE_PIXELS
+    """
+    for fmt, image_class in HEADER_ONLY_FORMATS.items():
+        try:
+            image = image_class(path)
+        except SyntaxError:
+            continue
+
+        with image:
+            width, height = image.size
+            if max_pixels is not None and width * height > max_pixels:
+                raise Image.DecompressionBombError(f"圖片太大: {width}×{height} 超過 {max_pixels} 像素的上限")
+
+            pixels = raw_pixel_memmap(image)
+            if pixels is not None:
+                return pixels
+
+        if fmt == 'PNG':
+            try:
+                return PngStripReader(path)
+            except ValueError:
+                pass
+        return Image.open(path, formats=[fmt])
+
+    return Image.open(path)
+
+
+def raw_pixel_memmap(image):
+    """
+    功能:
+        未壓縮、由上而下儲存的單一像素區段（例如未壓縮 TIFF、PPM/PGM）直接以 memmap 讀取
+
+    返回:
+        pixels: np.memmap (H×W 或 H×W×C)；格式不適用時返回 None
+    """
+    filename = getattr(image, 'filename', None)
+    if not filename or len(image.tile) != 1 or image.mode not in RAW_MODE_CHANNELS:
+        return None
+
+    codec, extents, offset, args = image.tile[0]
+    args = args if isinstance(args, tuple) else (args,)
+    width, height = image.size
+    channels = RAW_MODE_CHANNELS[image.mode]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+
+    if codec != 'raw' or args[0] != image.mode or tuple(extents) != (0, 0, width, height):
+        return None
+    if stride not in (0, width * channels) or orientation != 1:
+        return None
+
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    return np.memmap(filename, dtype=np.uint8, mode='r', offset=offset, shape=shape)
+
+
+def open_cover_pixels(source, max_pixels=TILED_MAX_PIXELS):
+    """
+    功能:
+        取得載體像素的陣列介面，盡量不把整張圖讀進記憶體
+
+    參數:
+        source: numpy array / np.memmap、.npy 檔路徑、圖片檔路徑或 PIL Image
+        max_pixels: 開啟圖片檔時允許的最大像素數
+
+    返回:
+        pixels: 可切片的陣列 (H×W 或 H×W×C)、PngStripReader 或 PIL Image（都以 read_pixel_rows 逐條讀取）
+
+    說明:
+        - numpy array / memmap：直接使用
+        - .npy 檔：np.load(mmap_mode='r')
+        - 未壓縮的 TIFF、PPM/PGM：raw_pixel_memmap
+        - 非交錯 8 bits PNG：PngStripReader 逐條解壓縮
+        - 其他格式（JPEG、壓縮 TIFF 等）：PIL 只能整張解碼，峰值記憶體是整張圖；
+          像素只留在 PIL Image 中一份，每個橫條再以 crop 取出，不另外建立整張的 numpy 複本
+    """
+    if isinstance(source, np.ndarray):
+        return source
+
+    if isinstance(source, (str, os.PathLike)):
+        if os.fspath(source).lower().endswith('.npy'):
+            return np.load(source, mmap_mode='r')
+        source = open_image_file(source, max_pixels)
+
+    if isinstance(source, (np.ndarray, PngStripReader)):
+        return source
+
+    if isinstance(source, Image.Image):
+        pixels = raw_pixel_memmap(source)
+        return source if pixels is None else pixels
+
+    return np.asarray(source)
+
+
+def pixel_shape(pixels):
+    """
+    功能:
+        取得 open_cover_pixels 結果的 (高, 寬)
+    """
+    if isinstance(pixels, Image.Image):
+        return pixels.size[1], pixels.size[0]
+    return pixels.shape[:2]
+
+
+def read_pixel_rows(pixels, top, bottom, width):
+    """
+    功能:
+        讀取第 top 到 bottom 列、前 width 行的像素（只建立這一段的陣列）
+
+    返回:
+        rows: numpy array (列數×width 或 列數×width×C)，與 np.asarray(整張圖)[top:bottom, :width] 相同
+    """
+    if isinstance(pixels, PngStripReader):
+        return pixels.read_rows(top, bottom)[:, :width]
+    if isinstance(pixels, Image.Image):
+        return np.asarray(pixels.crop((0, top, width, bottom)))
+    return np.asarray(pixels[top:bottom, :width])
+
+
+def cover_dimensions(pixels, strict=True):
+    """
+    功能:
+        檢查載體尺寸並取得實際使用的高與寬（與 block_engine.prepare_cover 的規則相同）
+
+    返回:
+        height, width: 8 的倍數；strict=False 時裁掉不足一個區塊的邊緣
+    """
+    height, width = pixel_shape(pixels)
+
+    if height % BLOCK_SIZE != 0 or width % BLOCK_SIZE != 0:
+        if strict:
+            raise ValueError(f"圖片大小必須是 8 的倍數！當前大小: {width}×{height}")
+        height, width = height - height % BLOCK_SIZE, width - width % BLOCK_SIZE
+
+    return height, width
+
+
+def iter_gray_strips(pixels, strict=True, strip_rows=TILED_STRIP_ROWS):
+    """
+    功能:
+        依序產生灰階橫條（每條 strip_rows 列，最後一條可能較少）
+
+    參數:
+        pixels: open_cover_pixels 的結果
+        strict: True 時尺寸不是 8 的倍數會報錯；False 時裁掉邊緣
+        strip_rows: 每條的列數（8 的倍數）
+
+    返回:
+        產生器，依序產生 (起始列, 灰階橫條)
+    """
+    if strip_rows <= 0 or strip_rows % BLOCK_SIZE != 0:
+        raise ValueError(f"strip_rows 必須是 8 的正整數倍: {strip_rows}")
+
+    height, width = cover_dimensions(pixels, strict)
+
+    for top in range(0, height, strip_rows):
+        strip = read_pixel_rows(pixels, top, min(top + strip_rows, height), width)
+        yield top, to_grayscale(strip)